@@ -11,14 +11,20 @@ import uuid
 from datetime import datetime
 from pathlib import Path
 
+from TwitchChannelPointsMiner.classes.BetScheduler import BetScheduler
 from TwitchChannelPointsMiner.classes.Chat import ChatPresence, ThreadChat
 from TwitchChannelPointsMiner.classes.entities.PubsubTopic import PubsubTopic
 from TwitchChannelPointsMiner.classes.entities.Streamer import (
     Streamer,
     StreamerSettings,
 )
+from TwitchChannelPointsMiner.classes.EventsPredictions import EventsPredictions
 from TwitchChannelPointsMiner.classes.Exceptions import StreamerDoesNotExistException
+from TwitchChannelPointsMiner.classes.Metrics import Metrics
+from TwitchChannelPointsMiner.classes.PubSubRecorder import PubSubRecorder
 from TwitchChannelPointsMiner.classes.Settings import FollowersOrder, Priority, Settings
+from TwitchChannelPointsMiner.classes.StartupProfiler import StartupProfiler
+from TwitchChannelPointsMiner.classes.SubscriptionBudget import SubscriptionBudget
 from TwitchChannelPointsMiner.classes.Twitch import Twitch
 from TwitchChannelPointsMiner.classes.WebSocketsPool import WebSocketsPool
 from TwitchChannelPointsMiner.logger import LoggerSettings, configure_loggers
@@ -44,7 +50,7 @@ logging.getLogger("requests").setLevel(logging.ERROR)
 logging.getLogger("werkzeug").setLevel(logging.ERROR)
 logging.getLogger("irc.client").setLevel(logging.ERROR)
 logging.getLogger("seleniumwire").setLevel(logging.ERROR)
-logging.getLogger("websocket").setLevel(logging.ERROR)
+logging.getLogger("websockets").setLevel(logging.ERROR)
 
 logger = logging.getLogger(__name__)
 
@@ -62,6 +68,8 @@ class TwitchChannelPointsMiner:
         "events_predictions",
         "minute_watcher_thread",
         "sync_campaigns_thread",
+        "subscription_budget",
+        "subscription_budget_thread",
         "ws_pool",
         "session_id",
         "running",
@@ -69,6 +77,10 @@ class TwitchChannelPointsMiner:
         "original_streamers",
         "logs_file",
         "queue_listener",
+        "startup_profiler",
+        "pubsub_record_file",
+        "prediction_record_path",
+        "shadow_evaluator",
     ]
 
     def __init__(
@@ -79,6 +91,16 @@ class TwitchChannelPointsMiner:
         enable_analytics: bool = False,
         disable_ssl_cert_verification: bool = False,
         disable_at_in_nickname: bool = False,
+        # If set, dump a cProfile of the startup phase (login, context load, PubSub subscription) in this file
+        startup_profile_file: str = None,
+        # If set, record all the PubSub frames in this gzip file (rotated), can be replayed with pubsub_replay.py
+        pubsub_record_file: str = None,
+        # If set, record the outcomes and the result of each prediction in this folder, can be backtested with prediction_backtest.py
+        prediction_record_path: str = None,
+        # If True, evaluate all the strategies on each prediction (without betting) and report the profit of each one
+        shadow_strategies: bool = False,
+        # If set, the resolved predictions removed from memory are appended in this file (JSON lines)
+        predictions_archive_file: str = None,
         # Settings for logging and selenium as you can see.
         priority: list = [Priority.STREAK, Priority.DROPS, Priority.ORDER],
         # This settings will be global shared trought Settings class
@@ -143,15 +165,26 @@ class TwitchChannelPointsMiner:
         self.priority = priority if isinstance(priority, list) else [priority]
 
         self.streamers: list[Streamer] = []
-        self.events_predictions = {}
+        self.events_predictions = EventsPredictions(archive_file=predictions_archive_file)
         self.minute_watcher_thread = None
         self.sync_campaigns_thread = None
+        self.subscription_budget = None
+        self.subscription_budget_thread = None
         self.ws_pool = None
 
         self.session_id = str(uuid.uuid4())
         self.running = False
         self.start_datetime = None
         self.original_streamers = []
+        self.startup_profiler = StartupProfiler(profile_file=startup_profile_file)
+        self.pubsub_record_file = pubsub_record_file
+        self.prediction_record_path = prediction_record_path
+        self.shadow_evaluator = None
+        if shadow_strategies is True:
+            # Import here: NumPy is loaded only when needed
+            from TwitchChannelPointsMiner.classes.ShadowEvaluator import ShadowEvaluator
+
+            self.shadow_evaluator = ShadowEvaluator()
 
         self.logs_file, self.queue_listener = configure_loggers(
             self.username, logger_settings
@@ -225,178 +258,210 @@ class TwitchChannelPointsMiner:
             )
             self.running = True
             self.start_datetime = datetime.now()
+            profiler = self.startup_profiler
+            profiler.start()
+            try:
+                with profiler.phase("login"):
+                    self.twitch.login()
 
-            self.twitch.login()
+                if self.claim_drops_startup is True:
+                    with profiler.phase("claim_drops_from_inventory"):
+                        self.twitch.claim_all_drops_from_inventory()
 
-            if self.claim_drops_startup is True:
-                self.twitch.claim_all_drops_from_inventory()
+                streamers_name: list = []
+                streamers_dict: dict = {}
 
-            streamers_name: list = []
-            streamers_dict: dict = {}
+                for streamer in streamers:
+                    username = (
+                        streamer.username
+                        if isinstance(streamer, Streamer)
+                        else streamer.lower().strip()
+                    )
+                    if username not in blacklist:
+                        streamers_name.append(username)
+                        streamers_dict[username] = streamer
 
-            for streamer in streamers:
-                username = (
-                    streamer.username
-                    if isinstance(streamer, Streamer)
-                    else streamer.lower().strip()
-                )
-                if username not in blacklist:
-                    streamers_name.append(username)
-                    streamers_dict[username] = streamer
+                if followers is True:
+                    with profiler.phase("followers") as phase:
+                        followers_array = self.twitch.get_followers(order=followers_order)
+                        phase.count = len(followers_array)
+                    logger.info(
+                        f"Load {len(followers_array)} followers from your profile!",
+                        extra={"emoji": ":clipboard:"},
+                    )
+                    for username in followers_array:
+                        if username not in streamers_dict and username not in blacklist:
+                            streamers_name.append(username)
+                            streamers_dict[username] = username.lower().strip()
 
-            if followers is True:
-                followers_array = self.twitch.get_followers(order=followers_order)
                 logger.info(
-                    f"Load {len(followers_array)} followers from your profile!",
-                    extra={"emoji": ":clipboard:"},
+                    f"Loading data for {len(streamers_name)} streamers. Please wait...",
+                    extra={"emoji": ":nerd_face:"},
                 )
-                for username in followers_array:
-                    if username not in streamers_dict and username not in blacklist:
-                        streamers_name.append(username)
-                        streamers_dict[username] = username.lower().strip()
-
-            logger.info(
-                f"Loading data for {len(streamers_name)} streamers. Please wait...",
-                extra={"emoji": ":nerd_face:"},
-            )
-            for username in streamers_name:
-                if username in streamers_name:
-                    time.sleep(random.uniform(0.3, 0.7))
-                    try:
-                        streamer = (
-                            streamers_dict[username]
-                            if isinstance(streamers_dict[username], Streamer) is True
-                            else Streamer(username)
-                        )
-                        streamer.channel_id = self.twitch.get_channel_id(username)
-                        streamer.settings = set_default_settings(
-                            streamer.settings, Settings.streamer_settings
-                        )
-                        streamer.settings.bet = set_default_settings(
-                            streamer.settings.bet, Settings.streamer_settings.bet
-                        )
-                        if streamer.settings.chat != ChatPresence.NEVER:
-                            streamer.irc_chat = ThreadChat(
-                                self.username,
-                                self.twitch.twitch_login.get_auth_token(),
-                                streamer.username,
-                            )
-                        self.streamers.append(streamer)
-                    except StreamerDoesNotExistException:
-                        logger.info(
-                            f"Streamer {username} does not exist",
-                            extra={"emoji": ":cry:"},
-                        )
-
-            # Populate the streamers with default values.
-            # 1. Load channel points and auto-claim bonus
-            # 2. Check if streamers are online
-            # 3. DEACTIVATED: Check if the user is a moderator. (was used before the 5th of April 2021 to deactivate predictions)
-            for streamer in self.streamers:
-                time.sleep(random.uniform(0.3, 0.7))
-                self.twitch.load_channel_points_context(streamer)
-                self.twitch.check_streamer_online(streamer)
-                # self.twitch.viewer_is_mod(streamer)
-
-            self.original_streamers = [
-                streamer.channel_points for streamer in self.streamers
-            ]
-
-            # If we have at least one streamer with settings = make_predictions True
-            make_predictions = at_least_one_value_in_settings_is(
-                self.streamers, "make_predictions", True
-            )
-
-            # If we have at least one streamer with settings = claim_drops True
-            # Spawn a thread for sync inventory and dashboard
-            if (
-                at_least_one_value_in_settings_is(self.streamers, "claim_drops", True)
-                is True
-            ):
-                self.sync_campaigns_thread = threading.Thread(
-                    target=self.twitch.sync_campaigns,
-                    args=(self.streamers,),
+                with profiler.phase("channel_ids") as phase:
+                    for username in streamers_name:
+                        if username in streamers_name:
+                            time.sleep(random.uniform(0.3, 0.7))
+                            try:
+                                streamer = (
+                                    streamers_dict[username]
+                                    if isinstance(streamers_dict[username], Streamer) is True
+                                    else Streamer(username)
+                                )
+                                with profiler.measure(phase, username):
+                                    streamer.channel_id = self.twitch.get_channel_id(username)
+                                streamer.settings = set_default_settings(
+                                    streamer.settings, Settings.streamer_settings
+                                )
+                                streamer.settings.bet = set_default_settings(
+                                    streamer.settings.bet, Settings.streamer_settings.bet
+                                )
+                                if streamer.settings.chat != ChatPresence.NEVER:
+                                    streamer.irc_chat = ThreadChat(
+                                        self.username,
+                                        self.twitch.twitch_login.get_auth_token(),
+                                        streamer.username,
+                                    )
+                                self.streamers.append(streamer)
+                            except StreamerDoesNotExistException:
+                                logger.info(
+                                    f"Streamer {username} does not exist",
+                                    extra={"emoji": ":cry:"},
+                                )
+
+                # Populate the streamers with default values.
+                # 1. Load channel points and auto-claim bonus
+                # 2. Check if streamers are online
+                # 3. DEACTIVATED: Check if the user is a moderator. (was used before the 5th of April 2021 to deactivate predictions)
+                with profiler.phase("channel_points_context") as phase:
+                    for streamer in self.streamers:
+                        time.sleep(random.uniform(0.3, 0.7))
+                        with profiler.measure(phase, streamer.username):
+                            self.twitch.load_channel_points_context(streamer)
+                            self.twitch.check_streamer_online(streamer)
+                        # self.twitch.viewer_is_mod(streamer)
+
+                self.original_streamers = [
+                    streamer.channel_points for streamer in self.streamers
+                ]
+
+                # If we have at least one streamer with settings = make_predictions True
+                make_predictions = at_least_one_value_in_settings_is(
+                    self.streamers, "make_predictions", True
                 )
-                self.sync_campaigns_thread.name = "Sync campaigns/inventory"
-                self.sync_campaigns_thread.start()
-                time.sleep(30)
 
-            self.minute_watcher_thread = threading.Thread(
-                target=self.twitch.send_minute_watched_events,
-                args=(self.streamers, self.priority),
-            )
-            self.minute_watcher_thread.name = "Minute watcher"
-            self.minute_watcher_thread.start()
-
-            self.ws_pool = WebSocketsPool(
-                twitch=self.twitch,
-                streamers=self.streamers,
-                events_predictions=self.events_predictions,
-            )
-
-            # Subscribe to community-points-user. Get update for points spent or gains
-            user_id = self.twitch.twitch_login.get_user_id()
-            # print(f"!!!!!!!!!!!!!! USER_ID: {user_id}")
-
-            # Fixes 'ERR_BADAUTH'
-            if not user_id:
-                logger.error("No user_id, exiting...")
-                self.end(0, 0)
+                # If we have at least one streamer with settings = claim_drops True
+                # Spawn a thread for sync inventory and dashboard
+                if (
+                    at_least_one_value_in_settings_is(self.streamers, "claim_drops", True)
+                    is True
+                ):
+                    # Not a startup phase: the sync runs on its own thread
+                    self.sync_campaigns_thread = threading.Thread(
+                        target=self.twitch.sync_campaigns,
+                        args=(self.streamers,),
+                    )
+                    self.sync_campaigns_thread.name = "Sync campaigns/inventory"
+                    self.sync_campaigns_thread.start()
+                    time.sleep(30)
 
-            self.ws_pool.submit(
-                PubsubTopic(
-                    "community-points-user-v1",
-                    user_id=user_id,
+                self.minute_watcher_thread = threading.Thread(
+                    target=self.twitch.send_minute_watched_events,
+                    args=(self.streamers, self.priority),
                 )
-            )
+                self.minute_watcher_thread.name = "Minute watcher"
+                self.minute_watcher_thread.start()
+
+                # The pending bets are saved here, they are placed also after a restart. Created with the first bet
+                bet_scheduler = BetScheduler(
+                    self.twitch.commit_prediction,
+                    persist_file=os.path.join(
+                        Path().absolute(), "bets", f"{self.username}.json"
+                    ),
+                    prepare=self.twitch.prepare_prediction,
+                )
+                if self.prediction_record_path is not None:
+                    # Import here: NumPy is loaded only when the recorder is enabled
+                    from TwitchChannelPointsMiner.classes.PredictionRecorder import (
+                        PredictionRecorder,
+                    )
 
-            # Going to subscribe to predictions-user-v1. Get update when we place a new prediction (confirm)
-            if make_predictions is True:
-                self.ws_pool.submit(
-                    PubsubTopic(
-                        "predictions-user-v1",
-                        user_id=user_id,
+                    bet_scheduler.observers.append(
+                        PredictionRecorder(
+                            os.path.join(self.prediction_record_path, self.username)
+                        )
                     )
+                if self.shadow_evaluator is not None:
+                    bet_scheduler.observers.append(self.shadow_evaluator)
+                bet_scheduler.start()
+
+                self.ws_pool = WebSocketsPool(
+                    twitch=self.twitch,
+                    streamers=self.streamers,
+                    events_predictions=self.events_predictions,
+                    recorder=(
+                        PubSubRecorder(self.pubsub_record_file)
+                        if self.pubsub_record_file is not None
+                        else None
+                    ),
+                    bet_scheduler=bet_scheduler,
                 )
+                bet_scheduler.restore(self.ws_pool.get_streamer, self.events_predictions)
 
-            for streamer in self.streamers:
-                self.ws_pool.submit(
-                    PubsubTopic("video-playback-by-id", streamer=streamer)
-                )
+                # Subscribe to community-points-user. Get update for points spent or gains
+                user_id = self.twitch.twitch_login.get_user_id()
+                # print(f"!!!!!!!!!!!!!! USER_ID: {user_id}")
 
-                if streamer.settings.follow_raid is True:
-                    self.ws_pool.submit(PubsubTopic("raid", streamer=streamer))
+                # Fixes 'ERR_BADAUTH'
+                if not user_id:
+                    logger.error("No user_id, exiting...")
+                    self.end(0, 0)
 
-                if streamer.settings.make_predictions is True:
-                    self.ws_pool.submit(
-                        PubsubTopic("predictions-channel-v1", streamer=streamer)
-                    )
+                with profiler.phase("pubsub_subscription") as phase:
+                    user_topics = [PubsubTopic("community-points-user-v1", user_id=user_id)]
 
-                if streamer.settings.claim_moments is True:
-                    self.ws_pool.submit(
-                        PubsubTopic("community-moments-channel-v1", streamer=streamer)
-                    )
+                    # Going to subscribe to predictions-user-v1. Get update when we place a new prediction (confirm)
+                    if make_predictions is True:
+                        user_topics.append(
+                            PubsubTopic("predictions-user-v1", user_id=user_id)
+                        )
+                    self.ws_pool.submit(user_topics)
 
-                if streamer.settings.community_goals is True:
-                    self.ws_pool.submit(
-                        PubsubTopic("community-points-channel-v1", streamer=streamer)
+                    # The topics of a streamer are submitted together, they are placed on the same connection
+                    # Over the PubSub limits only the most valuable streamers are subscribed, the others are polled
+                    self.subscription_budget = SubscriptionBudget(
+                        self.ws_pool, self.twitch, self.streamers, reserved=len(user_topics)
                     )
+                    self.subscription_budget.rotate()
+                    if self.subscription_budget.is_over_budget() is True:
+                        self.subscription_budget_thread = threading.Thread(
+                            target=self.subscription_budget.run
+                        )
+                        self.subscription_budget_thread.name = "PubSub subscription budget"
+                        self.subscription_budget_thread.start()
+
+                    phase.count = sum(len(ws.topics) for ws in self.ws_pool.ws)
+            finally:
+                # Also when the bootstrap fails, the profile is still useful
+                profiler.stop()
+            profiler.report()
 
             refresh_context = time.time()
             while self.running:
                 time.sleep(random.uniform(20, 60))
                 # Do an external control for WebSocket. Check if the thread is running
                 # Check if is not None because maybe we have already created a new connection on array+1 and now index is None
-                for index in range(0, len(self.ws_pool.ws)):
+                # Copy of the list, the connections can be compacted by the pool in the meantime
+                for ws in list(self.ws_pool.ws):
                     if (
-                        self.ws_pool.ws[index].is_reconnecting is False
-                        and self.ws_pool.ws[index].elapsed_last_ping() > 10
+                        ws.is_reconnecting is False
+                        and ws.elapsed_last_ping() > 10
                         and internet_connection_available() is True
                     ):
                         logger.info(
-                            f"#{index} - The last PING was sent more than 10 minutes ago. Reconnecting to the WebSocket..."
+                            f"#{ws.index} - The last PING was sent more than 10 minutes ago. Reconnecting to the WebSocket..."
                         )
-                        WebSocketsPool.handle_reconnection(self.ws_pool.ws[index])
+                        WebSocketsPool.handle_reconnection(ws)
 
                 if ((time.time() - refresh_context) // 60) >= 30:
                     refresh_context = time.time()
@@ -431,6 +496,9 @@ class TwitchChannelPointsMiner:
         if self.sync_campaigns_thread is not None:
             self.sync_campaigns_thread.join()
 
+        if self.subscription_budget_thread is not None:
+            self.subscription_budget_thread.join()
+
         # Check if all the mutex are unlocked.
         # Prevent breaks of .json file
         for streamer in self.streamers:
@@ -439,6 +507,7 @@ class TwitchChannelPointsMiner:
                 streamer.mutex.release()
 
         self.__print_report()
+        self.events_predictions.close()
 
         # Stop the queue listener to make sure all messages have been logged
         self.queue_listener.stop()
@@ -459,10 +528,27 @@ class TwitchChannelPointsMiner:
             extra={"emoji": ":hourglass:"},
         )
 
-        if not Settings.logger.less and self.events_predictions != {}:
+        if not Settings.logger.less:
+            # Handlers timing and errors, available also on /metrics of the analytics server
+            Metrics.report(prefix="pubsub.")
+            Metrics.report(prefix="bets.")
+            Metrics.report(prefix="clock.")
+            Metrics.report(prefix="drops.")
+            if self.shadow_evaluator is not None:
+                self.shadow_evaluator.report()
+
+        summaries = self.events_predictions.evicted_summaries()
+        if not Settings.logger.less and (self.events_predictions != {} or summaries != {}):
             print("")
-            for event_id in self.events_predictions:
-                event = self.events_predictions[event_id]
+            # The older predictions are not in memory anymore, only their totals
+            for username in sorted(summaries):
+                summary = summaries[username]
+                logger.info(
+                    f"{username} - {summary['bets']} older predictions: {summary['WIN']} won, {summary['LOSE']} lost, "
+                    f"{summary['REFUND']} refunded, {'+' if summary['gained'] >= 0 else ''}{_millify(summary['gained'])} gained",
+                    extra={"emoji": ":bar_chart:"},
+                )
+            for event in self.events_predictions.events():
                 if (
                     event.bet_confirmed is True
                     and event.streamer.settings.make_predictions is True
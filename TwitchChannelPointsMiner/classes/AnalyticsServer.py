@@ -8,6 +8,7 @@ from threading import Thread
 import pandas as pd
 from flask import Flask, Response, cli, render_template, request
 
+from TwitchChannelPointsMiner.classes.Metrics import Metrics
 from TwitchChannelPointsMiner.classes.Settings import Settings
 from TwitchChannelPointsMiner.utils import download_file
 
@@ -189,6 +190,15 @@ def streamers():
     )
 
 
+def metrics():
+    prefix = request.args.get("prefix", default="", type=str)
+    return Response(
+        json.dumps(Metrics.snapshot(prefix=prefix)),
+        status=200,
+        mimetype="application/json",
+    )
+
+
 def download_assets(assets_folder, required_files):
     Path(assets_folder).mkdir(parents=True, exist_ok=True)
     logger.info(f"Downloading assets to {assets_folder}")
@@ -285,6 +295,8 @@ class AnalyticsServer(Thread):
                               json_all, methods=["GET"])
         self.app.add_url_rule(
             "/log", "log", generate_log, methods=["GET"])
+        self.app.add_url_rule(
+            "/metrics", "metrics", metrics, methods=["GET"])
 
     def run(self):
         logger.info(
@@ -0,0 +1,302 @@
+import heapq
+import itertools
+import json
+import logging
+import os
+import time
+from threading import Condition, Lock, Thread
+
+from dateutil import parser
+
+from TwitchChannelPointsMiner.classes.entities.EventPrediction import EventPrediction
+from TwitchChannelPointsMiner.classes.Metrics import Metrics
+from TwitchChannelPointsMiner.classes.Settings import Events
+from TwitchChannelPointsMiner.classes.WorkerPool import OrderedWorkerPool
+
+logger = logging.getLogger(__name__)
+
+
+class ScheduledBet(object):
+    __slots__ = ["event", "due", "prepare_at", "cancelled", "fired"]
+
+    def __init__(self, event, due, prepare_at=None):
+        self.event = event
+        # Epoch, survives a restart
+        self.due = due
+        # Epoch of the prepare phase, None once prepared (or without prepare)
+        self.prepare_at = prepare_at
+        self.cancelled = False
+        # A prepare still queued at this point is useless
+        self.fired = False
+
+    def to_dict(self):
+        event = self.event
+        return {
+            "due": self.due,
+            "channel_id": str(event.streamer.channel_id),
+            "event_id": event.event_id,
+            "title": event.title,
+            "created_at": event.created_at.isoformat(),
+            "prediction_window_seconds": event.prediction_window_seconds,
+            "closes_at": event.timeline.closes_at,
+            "status": event.status,
+            "outcomes": [outcome.to_dict() for outcome in event.bet.outcomes],
+        }
+
+
+class BetScheduler(object):
+    """
+    A single thread waits for the next bet of a due-time heap, the bets are placed on a small worker pool.
+    Replace the sleeping threading.Timer of each event, the bets can be cancelled and are saved on disk.
+    With a prepare callback each bet has two phases: prepare, PREPARE_BEFORE seconds (plus the refresh timeout)
+    before the due time, and the callback at the due time. The prepares have their own lane and the callback never
+    waits for them: a slow prepare never delays a due bet, the bet is then placed on the outcomes received so far.
+    """
+
+    # Seconds
+    PREPARE_BEFORE = 2
+
+    __slots__ = [
+        "callback",
+        "persist_file",
+        "heap",
+        "bets",
+        "counter",
+        "condition",
+        "workers",
+        "preparing",
+        "thread",
+        "running",
+        "observers",
+        "prepare",
+        "save_lock",
+    ]
+
+    def __init__(
+        self, callback, persist_file=None, workers=2, observers=None, prepare=None
+    ):
+        # Called with the EventPrediction when the bet is due, usually Twitch.commit_prediction
+        self.callback = callback
+        # Called with the EventPrediction shortly before, usually Twitch.prepare_prediction
+        self.prepare = prepare
+        self.persist_file = persist_file
+        # (due, sequence, ScheduledBet)
+        self.heap = []
+        # event_id -> ScheduledBet, the pending bets
+        self.bets = {}
+        self.counter = itertools.count()
+        self.condition = Condition()
+        self.workers = OrderedWorkerPool(
+            "bets", workers=workers, prefix="bets.workers"
+        )
+        self.preparing = (
+            OrderedWorkerPool("prepare", workers=workers, prefix="bets.workers")
+            if prepare is not None
+            else None
+        )
+        self.thread = None
+        self.running = False
+        # Told about each decision and each result: PredictionRecorder, ShadowEvaluator
+        self.observers = observers or []
+        # save is called by the workers and by the scheduler thread, a single writer of the temp file
+        self.save_lock = Lock()
+
+    def start(self):
+        self.running = True
+        self.thread = Thread(target=self.__run)
+        self.thread.daemon = True
+        self.thread.name = "Bet scheduler"
+        self.thread.start()
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        # Nothing is submitted anymore, then wait for the bets in flight before closing the observers
+        if self.thread is not None:
+            self.thread.join()
+        for pool in [self.preparing, self.workers]:
+            if pool is not None:
+                pool.stop()
+                pool.join()
+        # The pending bets stay on disk for the next start
+        self.save()
+        for observer in self.observers:
+            observer.close()
+
+    def schedule(self, event, delay):
+        due = time.time() + delay
+        bet = ScheduledBet(
+            event,
+            due,
+            prepare_at=(
+                due
+                - BetScheduler.PREPARE_BEFORE
+                - event.bet.settings.refresh_timeout
+                if self.prepare is not None
+                else None
+            ),
+        )
+        with self.condition:
+            previous = self.bets.get(event.event_id, None)
+            if previous is not None:
+                previous.cancelled = True
+            self.bets[event.event_id] = bet
+            heapq.heappush(
+                self.heap, (bet.prepare_at or bet.due, next(self.counter), bet)
+            )
+            self.condition.notify()
+        Metrics.counter("bets.scheduled").inc()
+        self.save()
+        return bet
+
+    def cancel(self, event_id, reason=""):
+        with self.condition:
+            bet = self.bets.pop(event_id, None)
+            if bet is None:
+                return False
+            # Lazy deletion, skipped when popped from the heap
+            bet.cancelled = True
+            self.condition.notify()
+        Metrics.counter("bets.cancelled").inc()
+        logger.info(
+            f"Bet cancelled for {bet.event}{f' - {reason}' if reason else ''}",
+            extra={
+                "emoji": ":disappointed_relieved:",
+                "event": Events.BET_FAILED,
+            },
+        )
+        self.save()
+        return True
+
+    def resolve(self, event, outcomes, winning_outcome_id):
+        # The prediction is over (RESOLVED or CANCELED), outcomes are the final raw PubSub ones
+        for observer in self.observers:
+            try:
+                observer.resolve(event, outcomes, winning_outcome_id)
+            except Exception:
+                logger.error(f"Unable to handle the result of {event}", exc_info=True)
+
+    def pending(self):
+        with self.condition:
+            return list(self.bets.values())
+
+    def __run(self):
+        while True:
+            with self.condition:
+                while self.running is True:
+                    if self.heap == []:
+                        self.condition.wait()
+                        continue
+                    due, _, bet = self.heap[0]
+                    if bet.cancelled is True:
+                        heapq.heappop(self.heap)
+                        continue
+                    remaining = due - time.time()
+                    if remaining <= 0:
+                        heapq.heappop(self.heap)
+                        if bet.prepare_at is not None:
+                            # Back in the heap for the due time
+                            heapq.heappush(
+                                self.heap, (bet.due, next(self.counter), bet)
+                            )
+                        else:
+                            self.bets.pop(bet.event.event_id, None)
+                        break
+                    self.condition.wait(remaining)
+                if self.running is False:
+                    return
+            if bet.prepare_at is not None:
+                prepare_at, bet.prepare_at = bet.prepare_at, None
+                self.preparing.submit(
+                    bet.event.streamer.channel_id, self.__prepare, bet, prepare_at
+                )
+                continue
+            self.workers.submit(bet.event.streamer.channel_id, self.__fire, bet)
+            self.save()
+
+    def __prepare(self, bet, prepare_at):
+        # Too late (the prepare lane was busy): the callback places the bet without it
+        if bet.cancelled is True or bet.fired is True or time.time() >= bet.due:
+            Metrics.counter("bets.prepare.skipped").inc()
+            return
+        bet.event.timeline.mark("prepare_due", prepare_at)
+        try:
+            self.prepare(bet.event)
+        except Exception:
+            logger.error(f"Unable to prepare the bet for {bet.event}", exc_info=True)
+
+    def __fire(self, bet):
+        bet.fired = True
+        lateness = time.time() - bet.due
+        bet.event.timeline.mark("due", bet.due)
+        bet.event.timeline.mark("fired")
+        Metrics.histogram("bets.lateness.seconds").observe(max(lateness, 0))
+        Metrics.counter("bets.fired").inc()
+        logger.debug(
+            f"Bet fired {round(lateness, 3)}s after its target for {bet.event}"
+        )
+        self.callback(bet.event)
+        for observer in self.observers:
+            # The outcomes used for the decision
+            observer.snapshot(bet.event)
+
+    def save(self):
+        if self.persist_file is None:
+            return
+        with self.save_lock:
+            try:
+                bets = [bet.to_dict() for bet in self.pending()]
+                # Never used (or already empty): no file, no folder
+                if bets == [] and not os.path.isfile(self.persist_file):
+                    return
+                os.makedirs(os.path.dirname(self.persist_file), exist_ok=True)
+                temp_file = f"{self.persist_file}.tmp"
+                with open(temp_file, "w") as f:
+                    json.dump(bets, f)
+                os.replace(temp_file, self.persist_file)
+            except Exception:
+                logger.error("Unable to save the pending bets", exc_info=True)
+
+    def restore(self, get_streamer, events_predictions):
+        # Schedule again the bets saved before the restart, only the ones still in the future
+        if self.persist_file is None or not os.path.isfile(self.persist_file):
+            return 0
+        try:
+            with open(self.persist_file, "r") as f:
+                bets = json.load(f)
+        except Exception:
+            logger.error("Unable to load the pending bets", exc_info=True)
+            return 0
+
+        restored = 0
+        for item in bets:
+            streamer = get_streamer(item["channel_id"])
+            delay = item["due"] - time.time()
+            if (
+                streamer is None
+                or delay <= 0
+                or item["event_id"] in events_predictions
+            ):
+                continue
+            event = EventPrediction(
+                streamer,
+                item["event_id"],
+                item["title"],
+                parser.parse(item["created_at"]),
+                item["prediction_window_seconds"],
+                item["status"],
+                item["outcomes"],
+            )
+            event.timeline.closes_at = item.get("closes_at", None)
+            events_predictions[event.event_id] = event
+            self.schedule(event, delay)
+            restored += 1
+            logger.info(
+                f"Place the bet after: {round(delay, 2)}s for: {event} (restored)",
+                extra={
+                    "emoji": ":alarm_clock:",
+                    "event": Events.BET_START,
+                },
+            )
+        return restored
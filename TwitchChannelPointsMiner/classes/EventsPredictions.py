@@ -0,0 +1,144 @@
+import json
+import logging
+import os
+import time
+from threading import Lock
+
+from TwitchChannelPointsMiner.classes.entities.EventPrediction import PredictionState
+from TwitchChannelPointsMiner.classes.Metrics import Metrics
+from TwitchChannelPointsMiner.classes.WorkerPool import OrderedWorkerPool
+
+logger = logging.getLogger(__name__)
+
+
+class EventsPredictions(dict):
+    """
+    The prediction events by event_id, shared by the PubSub handlers and the bet scheduler.
+    The resolved events are evicted (and archived on disk, if archive_file is set) after RETENTION seconds
+    or when there are more than MAX_RESOLVED of them. The events never resolved are evicted after STALE_AFTER.
+    The bets of the evicted events are summarized per streamer for the final report.
+    """
+
+    __slots__ = ["archive_file", "evicted_at", "lock", "writer", "summaries"]
+
+    # Seconds, the result (prediction-result) arrives a few seconds after the resolution
+    RETENTION = 3600
+    MAX_RESOLVED = 200
+    # A lost event-updated, or the topic was unsubscribed
+    STALE_AFTER = 3 * 24 * 3600
+    # Seconds between two evictions
+    EVICT_INTERVAL = 60
+
+    def __init__(self, archive_file=None):
+        super().__init__()
+        self.archive_file = archive_file
+        self.evicted_at = time.time()
+        self.lock = Lock()
+        # The eviction runs on the fast lane, the file is written by its own thread
+        self.writer = None
+        # username -> {"bets", "WIN", "LOSE", "REFUND", "gained"} of the evicted bets
+        self.summaries = {}
+
+        if archive_file is not None:
+            directory = os.path.dirname(os.path.abspath(archive_file))
+            os.makedirs(directory, exist_ok=True)
+            self.writer = OrderedWorkerPool("archive", workers=1, prefix="bets.events")
+
+    def __setitem__(self, event_id, event):
+        with self.lock:
+            super().__setitem__(event_id, event)
+        # Evicted only when a new event is added, nothing grows in between
+        if time.time() - self.evicted_at > EventsPredictions.EVICT_INTERVAL:
+            self.evict()
+        Metrics.gauge("bets.events.tracked").set(len(self))
+
+    def evict(self, force=False):
+        now = time.time()
+        with self.lock:
+            self.evicted_at = now
+            resolved = []
+            evicted = []
+            for event_id, event in list(self.items()):
+                if event.state == PredictionState.RESOLVED:
+                    if force is True or now - event.resolved_at > EventsPredictions.RETENTION:
+                        evicted.append(event)
+                    else:
+                        resolved.append(event)
+                elif now - event.created_at.timestamp() > EventsPredictions.STALE_AFTER:
+                    evicted.append(event)
+            # Too many: the oldest resolved go first
+            if len(resolved) > EventsPredictions.MAX_RESOLVED:
+                resolved.sort(key=lambda event: event.resolved_at)
+                evicted += resolved[: len(resolved) - EventsPredictions.MAX_RESOLVED]
+            for event in evicted:
+                super().__delitem__(event.event_id)
+                self.__summarize(event)
+
+        if evicted != []:
+            Metrics.counter("bets.events.evicted").inc(len(evicted))
+            Metrics.gauge("bets.events.tracked").set(len(self))
+            self.__archive(
+                [event for event in evicted if event.state == PredictionState.RESOLVED]
+            )
+        return evicted
+
+    def events(self) -> list:
+        # Copy, the workers add and evict events meanwhile
+        with self.lock:
+            return list(self.values())
+
+    def evicted_summaries(self) -> dict:
+        with self.lock:
+            return {username: dict(summary) for username, summary in self.summaries.items()}
+
+    def close(self):
+        # Archive also the resolved events still in memory
+        self.evict(force=True)
+        if self.writer is not None:
+            self.writer.stop()
+            self.writer.join()
+
+    def __summarize(self, event):
+        if event.bet_confirmed is False or event.result["type"] is None:
+            return
+        summary = self.summaries.setdefault(
+            event.streamer.username,
+            {"bets": 0, "WIN": 0, "LOSE": 0, "REFUND": 0, "gained": 0},
+        )
+        summary["bets"] += 1
+        summary[event.result["type"]] = summary.get(event.result["type"], 0) + 1
+        summary["gained"] += event.result["gained"]
+
+    def __archive(self, events):
+        if self.writer is None or events == []:
+            return
+        # Serialized now, the events are not updated anymore but the file is written later
+        self.writer.submit(
+            self.archive_file, self.__write, [EventsPredictions.to_dict(event) for event in events]
+        )
+
+    def __write(self, items):
+        try:
+            with open(self.archive_file, "a", encoding="utf-8") as file:
+                for item in items:
+                    file.write(json.dumps(item) + "\n")
+            Metrics.counter("bets.events.archived").inc(len(items))
+        except Exception:
+            logger.error("Unable to archive the resolved predictions", exc_info=True)
+
+    @staticmethod
+    def to_dict(event):
+        return {
+            "event_id": event.event_id,
+            "channel_id": str(event.streamer.channel_id),
+            "streamer": event.streamer.username,
+            "title": event.title,
+            "created_at": event.created_at.isoformat(),
+            "resolved_at": event.resolved_at,
+            "status": event.status,
+            "bet_confirmed": event.bet_confirmed,
+            "decision": event.bet.decision,
+            "result": event.result,
+            "timeline": event.timeline.marks,
+            "outcomes": [outcome.to_dict() for outcome in event.bet.outcomes],
+        }
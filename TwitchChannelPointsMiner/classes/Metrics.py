@@ -0,0 +1,157 @@
+import logging
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from threading import Lock
+
+logger = logging.getLogger(__name__)
+
+
+class Counter(object):
+    __slots__ = ["name", "value", "lock"]
+
+    def __init__(self, name):
+        self.name = name
+        self.value = 0
+        self.lock = Lock()
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def as_dict(self):
+        return self.value
+
+    def is_empty(self):
+        return self.value == 0
+
+    def __repr__(self):
+        return f"{self.name}={self.value}"
+
+
+class Gauge(object):
+    __slots__ = ["name", "value"]
+
+    def __init__(self, name):
+        self.name = name
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+    def as_dict(self):
+        return self.value
+
+    def is_empty(self):
+        return False
+
+    def __repr__(self):
+        return f"{self.name}={self.value}"
+
+
+class Histogram(object):
+    # Seconds. Usually used for timings, can be overridden for other kind of values
+    DEFAULT_BUCKETS = [0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60]
+
+    __slots__ = ["name", "buckets", "counts", "count", "total", "min", "max", "lock"]
+
+    def __init__(self, name, buckets=None):
+        self.name = name
+        self.buckets = sorted(buckets or Histogram.DEFAULT_BUCKETS)
+        # The last slot counts the values above the biggest bucket
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+        self.lock = Lock()
+
+    def observe(self, value):
+        with self.lock:
+            self.counts[bisect_left(self.buckets, value)] += 1
+            self.count += 1
+            self.total += value
+            self.min = value if self.min is None else min(self.min, value)
+            self.max = value if self.max is None else max(self.max, value)
+
+    def is_empty(self):
+        return self.count == 0
+
+    def mean(self):
+        return 0 if self.count == 0 else self.total / self.count
+
+    def as_dict(self):
+        return {
+            "count": self.count,
+            "mean": round(self.mean(), 6),
+            "min": self.min,
+            "max": self.max,
+            "buckets": {
+                f"<={bucket}": count
+                for bucket, count in zip(self.buckets + ["+Inf"], self.counts)
+            },
+        }
+
+    def __repr__(self):
+        return (
+            f"{self.name}: count={self.count}, mean={round(self.mean(), 4)}, min={self.min}, max={self.max}"
+            if self.count > 0
+            else f"{self.name}: count=0"
+        )
+
+
+# Global registry shared between classes, same as Settings
+class Metrics(object):
+    registry = {}
+    lock = Lock()
+
+    @classmethod
+    def __get(cls, name, factory):
+        metric = cls.registry.get(name, None)
+        if metric is None:
+            with cls.lock:
+                metric = cls.registry.get(name, None)
+                if metric is None:
+                    metric = cls.registry[name] = factory()
+        return metric
+
+    @classmethod
+    def counter(cls, name) -> Counter:
+        return cls.__get(name, lambda: Counter(name))
+
+    @classmethod
+    def gauge(cls, name) -> Gauge:
+        return cls.__get(name, lambda: Gauge(name))
+
+    @classmethod
+    def histogram(cls, name, buckets=None) -> Histogram:
+        return cls.__get(name, lambda: Histogram(name, buckets=buckets))
+
+    @classmethod
+    @contextmanager
+    def timer(cls, name):
+        histogram = cls.histogram(name)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            histogram.observe(time.perf_counter() - start)
+
+    @classmethod
+    def snapshot(cls, prefix="") -> dict:
+        return {
+            name: cls.registry[name].as_dict()
+            for name in sorted(cls.registry)
+            if name.startswith(prefix)
+        }
+
+    @classmethod
+    def reset(cls):
+        with cls.lock:
+            cls.registry = {}
+
+    @classmethod
+    def report(cls, prefix=""):
+        for name in sorted(cls.registry):
+            if name.startswith(prefix) and cls.registry[name].is_empty() is False:
+                logger.info(f"{cls.registry[name]}", extra={"emoji": ":bar_chart:"})
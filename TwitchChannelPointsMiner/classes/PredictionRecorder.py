@@ -0,0 +1,153 @@
+import logging
+import os
+import time
+from threading import Lock
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class PredictionRecorder(object):
+    """
+    Record each prediction: the outcomes at decision time, the final outcomes and the result.
+    Columnar NumPy chunks (npz) of `chunk_size` predictions, one row per prediction, the outcomes padded to MAX_OUTCOMES.
+    """
+
+    __slots__ = ["path", "chunk_size", "pending", "rows", "chunks", "lock"]
+
+    # Twitch allows up to 10 outcomes
+    MAX_OUTCOMES = 10
+    # Per outcome, shape (rows, MAX_OUTCOMES)
+    OUTCOME_COLUMNS = ["users", "points", "top_points", "final_users", "final_points"]
+
+    def __init__(self, path, chunk_size=100):
+        self.path = path
+        self.chunk_size = chunk_size
+        # event_id -> row, waiting for the result
+        self.pending = {}
+        # Complete rows, not written yet
+        self.rows = []
+        # Written chunks, for the unique file names
+        self.chunks = 0
+        self.lock = Lock()
+
+        os.makedirs(path, exist_ok=True)
+
+    def snapshot(self, event):
+        # Called once the bet is decided (or skipped): the outcomes used for the decision
+        row = PredictionRecorder.decision_row(event)
+        with self.lock:
+            self.pending[event.event_id] = row
+
+    def resolve(self, event, outcomes, winning_outcome_id):
+        # Called with the last event-updated (RESOLVED or CANCELED), outcomes are the raw PubSub ones
+        with self.lock:
+            row = self.pending.pop(event.event_id, None)
+        if row is None:
+            return
+        PredictionRecorder.result_row(row, event, outcomes, winning_outcome_id)
+
+        with self.lock:
+            self.rows.append(row)
+            rows = self.rows if len(self.rows) >= self.chunk_size else None
+            if rows is not None:
+                self.rows = []
+        if rows is not None:
+            self.__write(rows)
+
+    def close(self):
+        # The predictions without a result are lost
+        with self.lock:
+            rows, self.rows = self.rows, []
+        if rows != []:
+            self.__write(rows)
+
+    def __write(self, rows):
+        columns = PredictionRecorder.to_columns(rows)
+        with self.lock:
+            self.chunks += 1
+            file_name = os.path.join(
+                self.path, f"predictions-{int(time.time())}-{self.chunks}.npz"
+            )
+        try:
+            np.savez_compressed(file_name, **columns)
+            logger.debug(f"{len(rows)} predictions recorded in {file_name}")
+        except Exception:
+            logger.error("Unable to record the predictions", exc_info=True)
+
+    @staticmethod
+    def decision_row(event) -> dict:
+        bet = event.bet
+        return {
+            "event_id": event.event_id,
+            "channel_id": str(event.streamer.channel_id),
+            "created_at": event.created_at.timestamp(),
+            "decided_at": time.time(),
+            "balance": event.streamer.channel_points,
+            "outcomes": len(bet.outcomes),
+            "ids": [outcome.id for outcome in bet.outcomes],
+            "users": [outcome.total_users for outcome in bet.outcomes],
+            "points": [outcome.total_points for outcome in bet.outcomes],
+            "top_points": [outcome.top_points for outcome in bet.outcomes],
+        }
+
+    @staticmethod
+    def result_row(row, event, outcomes, winning_outcome_id):
+        row["final_users"] = [int(outcome["total_users"]) for outcome in outcomes]
+        row["final_points"] = [int(outcome["total_points"]) for outcome in outcomes]
+        # -1: cancelled, refunded
+        row["winner"] = (
+            row["ids"].index(winning_outcome_id)
+            if winning_outcome_id in row["ids"]
+            else -1
+        )
+        # Our own bet is included in the final points, the backtest removes it
+        if event.bet_confirmed is True and event.bet.decision.get("choice") is not None:
+            row["placed"] = event.bet.decision["choice"]
+            row["placed_amount"] = event.bet.decision["amount"]
+        else:
+            row["placed"] = -1
+            row["placed_amount"] = 0
+
+    @staticmethod
+    def to_columns(rows) -> dict:
+        size = len(rows)
+        columns = {
+            "event_id": np.array([row["event_id"] for row in rows]),
+            "channel_id": np.array([row["channel_id"] for row in rows]),
+            "created_at": np.array([row["created_at"] for row in rows], dtype=np.float64),
+            "decided_at": np.array([row["decided_at"] for row in rows], dtype=np.float64),
+            "balance": np.array([row["balance"] for row in rows], dtype=np.int64),
+            "outcomes": np.array([row["outcomes"] for row in rows], dtype=np.int8),
+            "winner": np.array([row["winner"] for row in rows], dtype=np.int8),
+            "placed": np.array([row["placed"] for row in rows], dtype=np.int8),
+            "placed_amount": np.array([row["placed_amount"] for row in rows], dtype=np.int64),
+        }
+        for name in PredictionRecorder.OUTCOME_COLUMNS:
+            column = np.zeros((size, PredictionRecorder.MAX_OUTCOMES), dtype=np.int64)
+            for index, row in enumerate(rows):
+                values = row[name][: PredictionRecorder.MAX_OUTCOMES]
+                column[index, : len(values)] = values
+            columns[name] = column
+        return columns
+
+    @staticmethod
+    def load(paths) -> dict:
+        # All the chunks in a single set of columns
+        chunks = []
+        for path in paths:
+            if os.path.isdir(path):
+                chunks += [
+                    os.path.join(path, name)
+                    for name in sorted(os.listdir(path))
+                    if name.endswith(".npz")
+                ]
+            else:
+                chunks.append(path)
+        columns = {}
+        for chunk in chunks:
+            with np.load(chunk) as data:
+                for name in data.files:
+                    columns.setdefault(name, []).append(data[name])
+        return {name: np.concatenate(values) for name, values in columns.items()}
@@ -0,0 +1,40 @@
+import time
+from collections import OrderedDict
+from threading import Lock
+
+from TwitchChannelPointsMiner.classes.Metrics import Metrics
+
+
+class PubSubDeduplicator(object):
+    __slots__ = ["window", "max_size", "seen", "lock", "duplicates"]
+
+    def __init__(self, window: float = 30, max_size: int = 10000):
+        # Messages are remembered for `window` seconds, but never more than `max_size` at the same time
+        self.window = window
+        self.max_size = max_size
+        # (identifier, timestamp) -> received at. Ordered by received at
+        self.seen = OrderedDict()
+        self.lock = Lock()
+        self.duplicates = Metrics.counter("pubsub.messages.duplicates")
+
+    def is_duplicate(self, identifier, timestamp) -> bool:
+        key = (identifier, timestamp)
+        now = time.time()
+        with self.lock:
+            self.__evict(now)
+            if key in self.seen:
+                self.duplicates.inc()
+                return True
+            self.seen[key] = now
+            return False
+
+    def __evict(self, now):
+        expire_before = now - self.window
+        while len(self.seen) > 0:
+            key, received_at = next(iter(self.seen.items()))
+            if received_at >= expire_before and len(self.seen) < self.max_size:
+                break
+            self.seen.popitem(last=False)
+
+    def __len__(self):
+        return len(self.seen)
@@ -0,0 +1,349 @@
+import logging
+import time
+
+from dateutil import parser
+
+from TwitchChannelPointsMiner.classes.entities.CommunityGoal import CommunityGoal
+from TwitchChannelPointsMiner.classes.entities.EventPrediction import EventPrediction
+from TwitchChannelPointsMiner.classes.entities.Raid import Raid
+from TwitchChannelPointsMiner.classes.Metrics import Metrics
+from TwitchChannelPointsMiner.classes.ServerClock import ServerClock
+from TwitchChannelPointsMiner.classes.Settings import Events, Settings
+
+logger = logging.getLogger(__name__)
+
+
+class PubSubHandler(object):
+    __slots__ = ["name", "topic", "types", "callback", "fast_lane", "timing", "errors"]
+
+    def __init__(self, topic, types, callback, name=None, fast_lane=False):
+        self.topic = topic
+        self.types = types
+        self.callback = callback
+        self.name = name if name is not None else callback.__name__
+        # Time sensitive handlers (bonus claim, predictions) don't wait behind the others
+        self.fast_lane = fast_lane
+        self.timing = Metrics.histogram(f"pubsub.handler.{self.name}.seconds")
+        self.errors = Metrics.counter(f"pubsub.handler.{self.name}.errors")
+
+    def __call__(self, ws, streamer, message):
+        start = time.perf_counter()
+        try:
+            self.callback(ws, streamer, message)
+        except Exception:
+            self.errors.inc()
+            logger.error(
+                f"Exception raised for topic: {message.topic} and message: {message}",
+                exc_info=True,
+            )
+        finally:
+            self.timing.observe(time.perf_counter() - start)
+
+    def __repr__(self):
+        return f"PubSubHandler(name={self.name}, topic={self.topic}, types={self.types})"
+
+
+class HandlersRegistry(object):
+    __slots__ = ["handlers"]
+
+    def __init__(self):
+        # topic -> {message_type: PubSubHandler}
+        self.handlers = {}
+
+    def register(self, topic, types, callback, name=None, fast_lane=False):
+        types = [types] if isinstance(types, str) else types
+        handler = PubSubHandler(topic, types, callback, name=name, fast_lane=fast_lane)
+        if topic not in self.handlers:
+            self.handlers[topic] = {}
+        for message_type in types:
+            self.handlers[topic][message_type] = handler
+        return handler
+
+    def unregister(self, topic, message_type=None):
+        if message_type is None:
+            self.handlers.pop(topic, None)
+        elif topic in self.handlers:
+            self.handlers[topic].pop(message_type, None)
+            if self.handlers[topic] == {}:
+                del self.handlers[topic]
+
+    def handles_topic(self, topic) -> bool:
+        return topic in self.handlers
+
+    def get(self, topic, message_type):
+        handlers = self.handlers.get(topic, None)
+        return None if handlers is None else handlers.get(message_type, None)
+
+    @staticmethod
+    def default():
+        registry = HandlersRegistry()
+        registry.register(
+            "community-points-user-v1", ["points-earned", "points-spent"], on_points
+        )
+        registry.register(
+            "community-points-user-v1",
+            "claim-available",
+            on_claim_available,
+            fast_lane=True,
+        )
+        registry.register("video-playback-by-id", "stream-up", on_stream_up)
+        registry.register("video-playback-by-id", "stream-down", on_stream_down)
+        registry.register("video-playback-by-id", "viewcount", on_viewcount)
+        registry.register("raid", "raid_update_v2", on_raid_update)
+        registry.register("community-moments-channel-v1", "active", on_moment_active)
+        registry.register(
+            "predictions-channel-v1", "event-created", on_event_created, fast_lane=True
+        )
+        registry.register(
+            "predictions-channel-v1", "event-updated", on_event_updated, fast_lane=True
+        )
+        registry.register(
+            "predictions-user-v1",
+            "prediction-result",
+            on_prediction_result,
+            fast_lane=True,
+        )
+        registry.register(
+            "predictions-user-v1",
+            "prediction-made",
+            on_prediction_made,
+            fast_lane=True,
+        )
+        registry.register(
+            "community-points-channel-v1",
+            ["community-goal-created", "community-goal-updated"],
+            on_community_goal,
+        )
+        registry.register(
+            "community-points-channel-v1",
+            "community-goal-deleted",
+            on_community_goal_deleted,
+        )
+        return registry
+
+
+# === community-points-user-v1 === #
+def on_points(ws, streamer, message):
+    balance = message.data["balance"]["balance"]
+    streamer.channel_points = balance
+    # Analytics switch
+    if Settings.enable_analytics is True:
+        streamer.persistent_series(
+            event_type=message.data["point_gain"]["reason_code"]
+            if message.type == "points-earned"
+            else "Spent"
+        )
+
+    if message.type == "points-earned":
+        earned = message.data["point_gain"]["total_points"]
+        reason_code = message.data["point_gain"]["reason_code"]
+
+        logger.info(
+            f"+{earned} → {streamer} - Reason: {reason_code}.",
+            extra={
+                "emoji": ":rocket:",
+                "event": Events.get(f"GAIN_FOR_{reason_code}"),
+            },
+        )
+        streamer.update_history(reason_code, earned)
+        # Analytics switch
+        if Settings.enable_analytics is True:
+            streamer.persistent_annotations(reason_code, f"+{earned} - {reason_code}")
+
+
+def on_claim_available(ws, streamer, message):
+    ws.twitch.claim_bonus(streamer, message.data["claim"]["id"])
+
+
+# === video-playback-by-id === #
+# There is stream-up message type, but it's sent earlier than the API updates
+def on_stream_up(ws, streamer, message):
+    streamer.stream_up = time.time()
+
+
+def on_stream_down(ws, streamer, message):
+    if streamer.is_online is True:
+        streamer.set_offline()
+
+
+def on_viewcount(ws, streamer, message):
+    if streamer.stream_up_elapsed():
+        ws.twitch.check_streamer_online(streamer)
+
+
+# === raid === #
+def on_raid_update(ws, streamer, message):
+    raid = Raid(
+        message.message["raid"]["id"],
+        message.message["raid"]["target_login"],
+    )
+    ws.twitch.update_raid(streamer, raid)
+
+
+# === community-moments-channel-v1 === #
+def on_moment_active(ws, streamer, message):
+    ws.twitch.claim_moment(streamer, message.data["moment_id"])
+
+
+# === predictions-channel-v1 === #
+def on_event_created(ws, streamer, message):
+    event_dict = message.data["event"]
+    event_id = event_dict["id"]
+    event_status = event_dict["status"]
+
+    if event_id in ws.events_predictions or event_status != "ACTIVE":
+        return
+
+    # Now on the Twitch clock, the message may have waited in the queues and the local clock may be skewed
+    current_tmsp = ServerClock.utcnow()
+
+    prediction_window_seconds = float(event_dict["prediction_window_seconds"])
+    # Reduce prediction window by 3/6s - Collect more accurate data for decision
+    prediction_window_seconds = streamer.get_prediction_window(
+        prediction_window_seconds
+    )
+    event = EventPrediction(
+        streamer,
+        event_id,
+        event_dict["title"],
+        parser.parse(event_dict["created_at"]),
+        prediction_window_seconds,
+        event_status,
+        event_dict["outcomes"],
+    )
+    # The real close time, the bet must land before it
+    event.timeline.closes_at = event.created_at.timestamp() + float(
+        event_dict["prediction_window_seconds"]
+    )
+    if streamer.is_online and event.closing_bet_after(current_tmsp) > 0:
+        bet_settings = streamer.settings.bet
+        if (
+            bet_settings.minimum_points is None
+            or streamer.channel_points > bet_settings.minimum_points
+        ):
+            ws.events_predictions[event_id] = event
+            event.timeline.mark("created", message.received_at)
+            start_after = event.closing_bet_after(current_tmsp)
+
+            ws.parent_pool.bet_scheduler.schedule(
+                ws.events_predictions[event_id], start_after
+            )
+
+            logger.info(
+                f"Place the bet after: {start_after}s for: {ws.events_predictions[event_id]}",
+                extra={
+                    "emoji": ":alarm_clock:",
+                    "event": Events.BET_START,
+                },
+            )
+        else:
+            logger.info(
+                f"{streamer} have only {streamer.channel_points} channel points and the minimum for bet is: {bet_settings.minimum_points}",
+                extra={
+                    "emoji": ":pushpin:",
+                    "event": Events.BET_FILTERS,
+                },
+            )
+
+
+def on_event_updated(ws, streamer, message):
+    event_dict = message.data["event"]
+    event_id = event_dict["id"]
+    if event_id in ws.events_predictions:
+        previous_status = ws.events_predictions[event_id].set_status(
+            event_dict["status"]
+        )
+        # Locked (or cancelled) before the bet, nothing to place anymore
+        if event_dict["status"] != previous_status and event_dict["status"] != "ACTIVE":
+            ws.parent_pool.bet_scheduler.cancel(
+                event_id, f"the event is {event_dict['status']}"
+            )
+            if event_dict["status"] in ["RESOLVED", "CANCELED"]:
+                ws.parent_pool.bet_scheduler.resolve(
+                    ws.events_predictions[event_id],
+                    event_dict["outcomes"],
+                    event_dict.get("winning_outcome_id", None),
+                )
+        # Game over we can't update anymore the values... The bet was placed!
+        # (a decision of the prepare phase is not final, the outcomes are still updated)
+        if ws.events_predictions[event_id].bet_placed is False:
+            ws.events_predictions[event_id].bet.set_snapshot(event_dict["outcomes"])
+
+
+# === predictions-user-v1 === #
+def on_prediction_result(ws, streamer, message):
+    event_id = message.data["prediction"]["event_id"]
+    if event_id not in ws.events_predictions:
+        return
+
+    event_prediction = ws.events_predictions[event_id]
+    if event_prediction.bet_confirmed is False:
+        return
+
+    points = event_prediction.parse_result(message.data["prediction"]["result"])
+
+    decision = event_prediction.bet.get_decision()
+    choice = event_prediction.bet.decision["choice"]
+
+    logger.info(
+        (
+            f"{event_prediction} - Decision: {choice}: {decision['title']} "
+            f"({decision['color']}) - Result: {event_prediction.result['string']}"
+        ),
+        extra={
+            "emoji": ":bar_chart:",
+            "event": Events.get(f"BET_{event_prediction.result['type']}"),
+        },
+    )
+
+    streamer.update_history("PREDICTION", points["gained"])
+
+    # Remove duplicate history records from previous message sent in community-points-user-v1
+    if event_prediction.result["type"] == "REFUND":
+        streamer.update_history("REFUND", -points["placed"], counter=-1)
+    elif event_prediction.result["type"] == "WIN":
+        streamer.update_history("PREDICTION", -points["won"], counter=-1)
+
+    if event_prediction.result["type"]:
+        # Analytics switch
+        if Settings.enable_analytics is True:
+            streamer.persistent_annotations(
+                event_prediction.result["type"],
+                f"{ws.events_predictions[event_id].title}",
+            )
+
+
+def on_prediction_made(ws, streamer, message):
+    event_id = message.data["prediction"]["event_id"]
+    if event_id in ws.events_predictions:
+        event_prediction = ws.events_predictions[event_id]
+        event_prediction.bet_confirmed = True
+        event_prediction.timeline.mark("confirmed", message.received_at)
+        logger.debug(f"Bet confirmed for {event_prediction}: {event_prediction.timeline}")
+        # Analytics switch
+        if Settings.enable_analytics is True:
+            streamer.persistent_annotations(
+                "PREDICTION_MADE",
+                f"Decision: {event_prediction.bet.decision['choice']} - {event_prediction.title}",
+            )
+
+
+# === community-points-channel-v1 === #
+def on_community_goal(ws, streamer, message):
+    if message.type == "community-goal-created":
+        # TODO Untested, hard to find this happening live
+        streamer.add_community_goal(
+            CommunityGoal.from_pubsub(message.data["community_goal"])
+        )
+    else:
+        streamer.update_community_goal(
+            CommunityGoal.from_pubsub(message.data["community_goal"])
+        )
+    ws.twitch.contribute_to_community_goals(streamer)
+
+
+def on_community_goal_deleted(ws, streamer, message):
+    # TODO Untested, not sure what the message format for this is,
+    #      https://github.com/sammwyy/twitch-ps/blob/master/main.js#L417
+    #      suggests that it should be just the entire, now deleted, goal model
+    streamer.delete_community_goal(message.data["community_goal"]["id"])
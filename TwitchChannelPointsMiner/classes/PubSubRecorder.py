@@ -0,0 +1,91 @@
+import gzip
+import json
+import logging
+import os
+import time
+from threading import Lock
+
+logger = logging.getLogger(__name__)
+
+
+class PubSubRecorder(object):
+    """
+    Write the raw PubSub frames, with their receive time, in a gzip file of JSON lines: [received_at, ws index, frame].
+    The file is rotated after `max_bytes` (uncompressed), `path` is always the newest one, then path.1, path.2 ...
+    """
+
+    __slots__ = ["path", "max_bytes", "backups", "file", "written", "flushed_at", "lock"]
+
+    # Seconds between two flushes, a crash loses at most the last frames
+    FLUSH_INTERVAL = 5
+
+    def __init__(self, path, max_bytes=64 * 1024 * 1024, backups=3):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.file = None
+        self.written = 0
+        self.flushed_at = time.time()
+        self.lock = Lock()
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+    def record(self, index, frame, received_at=None):
+        line = (
+            json.dumps(
+                [round(received_at or time.time(), 3), index, frame],
+                separators=(",", ":"),
+            )
+            + "\n"
+        ).encode("utf-8")
+        with self.lock:
+            if self.file is None:
+                self.__open()
+            elif self.written + len(line) > self.max_bytes:
+                self.__rotate()
+            self.file.write(line)
+            self.written += len(line)
+            if time.time() - self.flushed_at > PubSubRecorder.FLUSH_INTERVAL:
+                self.file.flush()
+                self.flushed_at = time.time()
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+    def __open(self):
+        # Append: a restart continues the same file, gzip supports concatenated members
+        # The size on disk is compressed, a lower bound of what was written before: the limit holds across restarts
+        self.written = os.path.getsize(self.path) if os.path.isfile(self.path) else 0
+        self.file = gzip.open(self.path, "ab")
+        logger.info(f"Recording the PubSub frames in {self.path}")
+
+    def __rotate(self):
+        self.file.close()
+        for index in range(self.backups - 1, 0, -1):
+            source = f"{self.path}.{index}"
+            if os.path.isfile(source):
+                os.replace(source, f"{self.path}.{index + 1}")
+        if self.backups > 0:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        self.__open()
+
+    @staticmethod
+    def read(paths):
+        # Yield (received_at, ws index, frame), oldest file first
+        for path in paths:
+            with gzip.open(path, "rt", encoding="utf-8") as file:
+                try:
+                    for line in file:
+                        line = line.strip()
+                        if line != "":
+                            received_at, index, frame = json.loads(line)
+                            yield received_at, index, frame
+                except (EOFError, ValueError):
+                    # The miner was killed while writing, the last frames are truncated
+                    logger.warning(f"{path} is truncated, the last frames are skipped")
@@ -0,0 +1,78 @@
+import logging
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from threading import Lock
+
+from TwitchChannelPointsMiner.classes.Metrics import Metrics
+
+logger = logging.getLogger(__name__)
+
+
+# Global estimation of the Twitch clock, same as Settings and Metrics
+class ServerClock(object):
+    """
+    Smoothed offset between the Twitch clock and the local one: server time = local time + offset.
+    Fed by the server_time of the PubSub messages and by the Date header of the GQL responses.
+    """
+
+    # Seconds
+    offset = 0.0
+    samples = 0
+    # Consecutive outliers, too many: the local clock has jumped
+    outliers = 0
+    lock = Lock()
+
+    # Weight of a new sample
+    ALPHA = 0.1
+    # A sample so far from the current offset is an outlier (a message stuck somewhere), not a skew
+    MAX_DEVIATION = 30
+    MAX_OUTLIERS = 10
+
+    @classmethod
+    def observe(cls, server_time, local_time, source="pubsub"):
+        sample = server_time - local_time
+        with cls.lock:
+            if abs(sample - cls.offset) > ServerClock.MAX_DEVIATION and cls.samples > 0:
+                cls.outliers += 1
+                if cls.outliers < ServerClock.MAX_OUTLIERS:
+                    Metrics.counter("clock.samples.outliers").inc()
+                    return
+                logger.info(f"The local clock has jumped, new offset with Twitch: {round(sample, 3)}s")
+                cls.samples = 0
+            if cls.samples == 0:
+                cls.offset = sample
+            else:
+                cls.offset += ServerClock.ALPHA * (sample - cls.offset)
+            cls.samples += 1
+            cls.outliers = 0
+            offset = cls.offset
+        Metrics.counter(f"clock.samples.{source}").inc()
+        Metrics.gauge("clock.offset.seconds").set(round(offset, 3))
+
+    @classmethod
+    def observe_http_date(cls, date, sent_at, received_at):
+        # The Date header has a precision of one second, truncated: +0.5s on average
+        if date is None:
+            return
+        try:
+            server_time = parsedate_to_datetime(date).timestamp() + 0.5
+        except (TypeError, ValueError):
+            return
+        cls.observe(server_time, (sent_at + received_at) / 2, source="gql")
+
+    @classmethod
+    def now(cls) -> float:
+        # Current epoch on the Twitch clock
+        return time.time() + cls.offset
+
+    @classmethod
+    def utcnow(cls) -> datetime:
+        return datetime.fromtimestamp(cls.now(), timezone.utc)
+
+    @classmethod
+    def reset(cls):
+        with cls.lock:
+            cls.offset = 0.0
+            cls.samples = 0
+            cls.outliers = 0
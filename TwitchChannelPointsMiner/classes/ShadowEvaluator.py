@@ -0,0 +1,103 @@
+import logging
+from threading import Lock
+
+import numpy as np
+
+from TwitchChannelPointsMiner.classes.entities.Bet import Strategy
+from TwitchChannelPointsMiner.classes.Metrics import Metrics
+from TwitchChannelPointsMiner.classes.PredictionRecorder import PredictionRecorder
+from TwitchChannelPointsMiner.classes.VectorizedBet import (
+    Predictions,
+    calculate_amount,
+    calculate_choice,
+    skip,
+)
+from TwitchChannelPointsMiner.utils import _millify
+
+logger = logging.getLogger(__name__)
+
+
+class ShadowEvaluator(object):
+    """
+    Evaluate all the strategies on the same outcomes of each real decision, without placing any bet.
+    The streamer BetSettings are kept, only the strategy changes. The profits are aggregated per streamer.
+    """
+
+    __slots__ = ["pending", "results", "lock"]
+
+    def __init__(self):
+        # event_id -> decision row (PredictionRecorder)
+        self.pending = {}
+        # username -> strategy name -> {"bets", "wins", "gained"}
+        self.results = {}
+        self.lock = Lock()
+
+    def snapshot(self, event):
+        row = PredictionRecorder.decision_row(event)
+        with self.lock:
+            self.pending[event.event_id] = row
+
+    def resolve(self, event, outcomes, winning_outcome_id):
+        with self.lock:
+            row = self.pending.pop(event.event_id, None)
+        if row is None:
+            return
+        PredictionRecorder.result_row(row, event, outcomes, winning_outcome_id)
+        # Cancelled: everybody is refunded, nothing to compare
+        if row["winner"] < 0:
+            return
+
+        settings = event.streamer.settings.bet
+        predictions = Predictions(PredictionRecorder.to_columns([row]))
+        percentage = np.array([settings.percentage], dtype=np.float64)
+        max_points = np.array([settings.max_points], dtype=np.float64)
+        stealth_mode = np.array([settings.stealth_mode], dtype=bool)
+
+        picks = []
+        with self.lock:
+            results = self.results.setdefault(event.streamer.username, {})
+            for strategy in Strategy:
+                choice = calculate_choice(predictions, strategy, settings.percentage_gap)
+                amount = calculate_amount(
+                    predictions, choice, percentage, max_points, stealth_mode
+                )
+                placed = (
+                    choice[0] >= 0
+                    and not skip(predictions, choice, settings.filter_condition)[0]
+                    and amount[0, 0] >= 10
+                )
+                result = results.setdefault(
+                    strategy.name, {"bets": 0, "wins": 0, "gained": 0}
+                )
+                if not placed:
+                    picks.append(f"{strategy.name}: -")
+                    continue
+                gained = int(predictions.gained(choice, amount)[0, 0])
+                result["bets"] += 1
+                result["wins"] += int(choice[0] == row["winner"])
+                result["gained"] += gained
+                Metrics.counter(f"bets.shadow.{strategy.name}.gained").inc(gained)
+                picks.append(f"{strategy.name}: {choice[0]} ({'+' if gained >= 0 else ''}{_millify(gained)})")
+
+        logger.debug(f"Shadow strategies for {event}: {', '.join(picks)}")
+
+    def close(self):
+        pass
+
+    def report(self):
+        for username in sorted(self.results):
+            ranking = sorted(
+                self.results[username].items(),
+                key=lambda item: item[1]["gained"],
+                reverse=True,
+            )
+            logger.info(
+                f"{username} - Shadow strategies: "
+                + ", ".join(
+                    f"{name} {'+' if result['gained'] >= 0 else ''}{_millify(result['gained'])} "
+                    f"({result['wins']}/{result['bets']})"
+                    for name, result in ranking
+                    if result["bets"] > 0
+                ),
+                extra={"emoji": ":bar_chart:"},
+            )
@@ -0,0 +1,109 @@
+import cProfile
+import json
+import logging
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+
+class StartupPhase(object):
+    __slots__ = ["name", "started_at", "elapsed", "count", "items"]
+
+    def __init__(self, name):
+        self.name = name
+        self.started_at = time.time()
+        self.elapsed = 0
+        self.count = 0
+        # Per-item timings (usually a streamer username) as {key: seconds}
+        self.items = {}
+
+    def slowest(self, limit=3):
+        return sorted(self.items.items(), key=lambda x: x[1], reverse=True)[:limit]
+
+    def as_dict(self, limit=3):
+        return {
+            "phase": self.name,
+            "seconds": round(self.elapsed, 3),
+            "count": self.count,
+            "slowest": [
+                {"key": key, "seconds": round(seconds, 3)}
+                for key, seconds in self.slowest(limit)
+            ],
+        }
+
+    def __repr__(self):
+        slowest = ", ".join(
+            f"{key} {round(seconds, 2)}s" for key, seconds in self.slowest()
+        )
+        return (
+            f"{self.name}: {round(self.elapsed, 2)}s, count={self.count}"
+            + (f", slowest=[{slowest}]" if slowest != "" else "")
+        )
+
+
+class StartupProfiler(object):
+    __slots__ = ["phases", "started_at", "profile_file", "profile"]
+
+    def __init__(self, profile_file: str = None):
+        self.phases = []
+        self.started_at = None
+        # If a path is provided dump a cProfile of the whole bootstrap there
+        self.profile_file = profile_file
+        self.profile = None
+
+    def start(self):
+        self.started_at = time.time()
+        if self.profile_file is not None:
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+
+    def stop(self):
+        if self.profile is not None:
+            self.profile.disable()
+            try:
+                self.profile.dump_stats(self.profile_file)
+                logger.info(
+                    f"Startup profile saved to: {self.profile_file}",
+                    extra={"emoji": ":page_facing_up:"},
+                )
+            except OSError as e:
+                logger.error(f"Unable to save the startup profile: {e}")
+            self.profile = None
+
+    @contextmanager
+    def phase(self, name):
+        # The count is set on the yielded phase, or by measure
+        current = StartupPhase(name)
+        self.phases.append(current)
+        try:
+            yield current
+        finally:
+            current.elapsed = time.time() - current.started_at
+
+    @contextmanager
+    def measure(self, current, key):
+        start = time.time()
+        try:
+            yield
+        finally:
+            current.items[key] = current.items.get(key, 0) + (time.time() - start)
+            current.count += 1
+
+    def elapsed(self):
+        return 0 if self.started_at is None else time.time() - self.started_at
+
+    def as_dict(self):
+        return {
+            "seconds": round(self.elapsed(), 3),
+            "phases": [phase.as_dict() for phase in self.phases],
+        }
+
+    def report(self):
+        logger.info(
+            f"Startup completed in {round(self.elapsed(), 2)}s",
+            extra={"emoji": ":hourglass:"},
+        )
+        for phase in self.phases:
+            logger.info(f"Startup phase {phase}", extra={"emoji": ":stopwatch:"})
+        logger.debug(f"Startup report: {json.dumps(self.as_dict())}")
@@ -0,0 +1,201 @@
+import logging
+import random
+import time
+
+from TwitchChannelPointsMiner.classes.entities.PubsubTopic import PubsubTopic
+from TwitchChannelPointsMiner.classes.Exceptions import StreamerIsOfflineException
+from TwitchChannelPointsMiner.classes.Metrics import Metrics
+
+logger = logging.getLogger(__name__)
+
+
+class SubscriptionBudget(object):
+    """
+    The PubSub limits (10 connections x 50 topics) are not enough for big lists of streamers.
+    The most valuable streamers are subscribed, the others are polled and rotated in when they become valuable.
+    """
+
+    __slots__ = [
+        "pool",
+        "twitch",
+        "streamers",
+        "reserved",
+        "subscribed",
+        "polled_at",
+        "rotated_at",
+        "rotation_required",
+    ]
+
+    # Seconds
+    ROTATE_INTERVAL = 600
+    POLL_INTERVAL = 300
+    # Max number of streamers swapped for each rotation, every swap costs a LISTEN and an UNLISTEN
+    MAX_SWAPS = 20
+
+    def __init__(self, pool, twitch, streamers, reserved=0):
+        self.pool = pool
+        self.twitch = twitch
+        self.streamers = streamers
+        # Topics already used by the user topics
+        self.reserved = reserved
+        # channel_id -> number of topics listened for the streamer
+        self.subscribed = {}
+        # channel_id -> last time we have checked the streamer status
+        self.polled_at = {}
+        self.rotated_at = 0
+        self.rotation_required = False
+
+    @staticmethod
+    def topics_for(streamer):
+        topics = [PubsubTopic("video-playback-by-id", streamer=streamer)]
+
+        if streamer.settings.follow_raid is True:
+            topics.append(PubsubTopic("raid", streamer=streamer))
+
+        if streamer.settings.make_predictions is True:
+            topics.append(PubsubTopic("predictions-channel-v1", streamer=streamer))
+
+        if streamer.settings.claim_moments is True:
+            topics.append(PubsubTopic("community-moments-channel-v1", streamer=streamer))
+
+        if streamer.settings.community_goals is True:
+            topics.append(PubsubTopic("community-points-channel-v1", streamer=streamer))
+
+        return topics
+
+    def capacity(self):
+        # A group of topics is never split between two connections, keep a margin for the holes
+        max_group = max([len(self.topics_for(streamer)) for streamer in self.streamers] + [1])
+        return (
+            self.pool.MAX_CONNECTIONS * (self.pool.MAX_TOPICS - (max_group - 1))
+            - self.reserved
+        )
+
+    def score(self, streamer):
+        score = 0
+        if streamer.is_online is True:
+            score += 100
+            if (
+                streamer.settings.watch_streak is True
+                and streamer.stream.watch_streak_missing is True
+            ):
+                score += 20
+            if streamer.drops_condition() is True:
+                score += 20
+            if streamer.settings.make_predictions is True:
+                score += 10
+        # Recently offline, maybe it's a short interruption of the stream
+        elif streamer.offline_at != 0 and time.time() - streamer.offline_at < 1800:
+            score += 30
+        # Small bonus for the streamers already subscribed, prevents the continuous swaps
+        if str(streamer.channel_id) in self.subscribed:
+            score += 5
+        return score
+
+    def is_over_budget(self):
+        return (
+            sum(len(self.topics_for(streamer)) for streamer in self.streamers)
+            > self.capacity()
+        )
+
+    def rotate(self):
+        self.rotated_at = time.time()
+        self.rotation_required = False
+
+        # Same score: keep the order of the streamers list
+        ranking = sorted(
+            range(0, len(self.streamers)),
+            key=lambda index: (-self.score(self.streamers[index]), index),
+        )
+        wanted = []
+        budget = self.capacity()
+        for index in ranking:
+            streamer = self.streamers[index]
+            size = len(self.topics_for(streamer))
+            if size <= budget:
+                wanted.append(streamer)
+                budget -= size
+
+        wanted_ids = set(str(streamer.channel_id) for streamer in wanted)
+        to_remove = [
+            streamer
+            for streamer in self.streamers
+            if str(streamer.channel_id) in self.subscribed
+            and str(streamer.channel_id) not in wanted_ids
+        ]
+        to_add = [
+            streamer
+            for streamer in wanted
+            if str(streamer.channel_id) not in self.subscribed
+        ]
+        # The first rotation subscribes everything, the next ones swap only a few streamers
+        if self.subscribed != {}:
+            to_remove = sorted(to_remove, key=self.score)[: SubscriptionBudget.MAX_SWAPS]
+            to_add = to_add[: SubscriptionBudget.MAX_SWAPS]
+
+        for streamer in to_remove:
+            self.pool.unsubscribe(streamer)
+            self.subscribed.pop(str(streamer.channel_id), None)
+
+        free = self.capacity() - sum(self.subscribed.values())
+        for streamer in to_add:
+            topics = self.topics_for(streamer)
+            if len(topics) <= free and self.pool.submit(topics) is True:
+                self.subscribed[str(streamer.channel_id)] = len(topics)
+                free -= len(topics)
+
+        Metrics.gauge("pubsub.budget.subscribed").set(len(self.subscribed))
+        Metrics.gauge("pubsub.budget.polled").set(
+            len(self.streamers) - len(self.subscribed)
+        )
+        if to_remove != [] or len(self.subscribed) < len(self.streamers):
+            logger.info(
+                f"PubSub budget: {len(self.subscribed)} streamers subscribed, "
+                f"{len(self.streamers) - len(self.subscribed)} polled every {SubscriptionBudget.POLL_INTERVAL // 60} minutes "
+                f"(+{len(to_add)} / -{len(to_remove)})"
+            )
+
+    def poll(self):
+        # Cheaper than PubSub for the streamers without topics: a single GQL request, only when it's time
+        now = time.time()
+        for streamer in self.streamers:
+            if self.twitch.running is False:
+                return
+            channel_id = str(streamer.channel_id)
+            if (
+                channel_id in self.subscribed
+                or now - self.polled_at.get(channel_id, 0)
+                < SubscriptionBudget.POLL_INTERVAL
+            ):
+                continue
+
+            self.polled_at[channel_id] = now
+            Metrics.counter("pubsub.budget.polls").inc()
+            was_online = streamer.is_online
+            try:
+                if streamer.is_online is False:
+                    # Raise StreamerIsOfflineException, don't go further for the offline streamers
+                    self.twitch.get_stream_info(streamer)
+                self.twitch.check_streamer_online(streamer)
+            except StreamerIsOfflineException:
+                pass
+            except Exception:
+                logger.error(f"Unable to poll {streamer}", exc_info=True)
+
+            if streamer.is_online != was_online:
+                self.rotation_required = True
+            time.sleep(random.uniform(0.3, 0.7))
+
+    def run(self):
+        while self.twitch.running:
+            if (
+                self.rotation_required is True
+                or time.time() - self.rotated_at > SubscriptionBudget.ROTATE_INTERVAL
+            ):
+                self.rotate()
+            self.poll()
+            # Sleep in small chunks, stop quickly on exit
+            for _ in range(random.randint(20, 40)):
+                if self.twitch.running is False:
+                    break
+                time.sleep(1)
@@ -15,6 +15,8 @@ import requests
 import validators
 # import json
 
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
 from pathlib import Path
 from secrets import choice, token_hex
 from typing import Dict, Any
@@ -35,6 +37,8 @@ from TwitchChannelPointsMiner.classes.Settings import (
     Priority,
     Settings,
 )
+from TwitchChannelPointsMiner.classes.Metrics import Metrics
+from TwitchChannelPointsMiner.classes.ServerClock import ServerClock
 from TwitchChannelPointsMiner.classes.TwitchLogin import TwitchLogin
 from TwitchChannelPointsMiner.constants import (
     CLIENT_ID,
@@ -63,9 +67,19 @@ class Twitch(object):
         # "integrity_expire",
         "client_session",
         "client_version",
+        "client_version_updated_at",
         "twilight_build_id_pattern",
+        "session",
+        "campaigns",
+        "campaigns_details",
+        "refresh_executor",
     ]
 
+    # Seconds
+    CLIENT_VERSION_TTL = 3600
+    # Below BetScheduler.PREPARE_BEFORE, a warm up never holds a refresh worker until the bet
+    WARM_UP_TIMEOUT = 1
+
     def __init__(self, username, user_agent, password=None):
         cookies_path = os.path.join(Path().absolute(), "cookies")
         Path(cookies_path).mkdir(parents=True, exist_ok=True)
@@ -82,9 +96,20 @@ class Twitch(object):
         # self.integrity_expire = 0
         self.client_session = token_hex(16)
         self.client_version = CLIENT_VERSION
+        self.client_version_updated_at = 0
         self.twilight_build_id_pattern = re.compile(
             r'window\.__twilightBuildID\s*=\s*"([0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12})"'
         )
+        # Keep-alive connections to GQL, a bet doesn't wait for a new TLS handshake
+        self.session = requests.Session()
+        # Outcomes refresh (GQL) with a deadline, and the connection warm up
+        self.refresh_executor = ThreadPoolExecutor(
+            max_workers=4, thread_name_prefix="Outcomes refresh"
+        )
+        # campaign id -> Campaign, kept across the syncs
+        self.campaigns = {}
+        # campaign id -> (endAt of the dashboard, DropCampaignDetails), fetched again only if endAt changes
+        self.campaigns_details = {}
 
     def login(self):
         if not os.path.isfile(self.cookies_file):
@@ -273,25 +298,45 @@ class Twitch(object):
             )
             self.__chuncked_sleep(random_sleep * 60, chunk_size=chunk_size)
 
-    def post_gql_request(self, json_data):
+    def gql_headers(self, update_version=True):
+        # update_version False: the cached client version, never a request (the bets path)
+        return {
+            "Authorization": f"OAuth {self.twitch_login.get_auth_token()}",
+            "Client-Id": CLIENT_ID,
+            # "Client-Integrity": self.post_integrity(),
+            "Client-Session-Id": self.client_session,
+            "Client-Version": (
+                self.update_client_version()
+                if update_version is True
+                else self.client_version
+            ),
+            "User-Agent": self.user_agent,
+            "X-Device-Id": self.device_id,
+        }
+
+    def __post_gql(self, json_data, timeout=None, headers=None):
+        # Raise requests.exceptions.RequestException
+        # headers: built in advance, update_client_version is a request on its own
+        if headers is None:
+            headers = self.gql_headers()
+        sent_at = time.time()
+        response = self.session.post(
+            GQLOperations.url,
+            json=json_data,
+            headers=headers,
+            timeout=timeout,
+        )
+        ServerClock.observe_http_date(
+            response.headers.get("Date", None), sent_at, time.time()
+        )
+        logger.debug(
+            f"Data: {json_data}, Status code: {response.status_code}, Content: {response.text}"
+        )
+        return response.json()
+
+    def post_gql_request(self, json_data, timeout=None, headers=None):
         try:
-            response = requests.post(
-                GQLOperations.url,
-                json=json_data,
-                headers={
-                    "Authorization": f"OAuth {self.twitch_login.get_auth_token()}",
-                    "Client-Id": CLIENT_ID,
-                    # "Client-Integrity": self.post_integrity(),
-                    "Client-Session-Id": self.client_session,
-                    "Client-Version": self.update_client_version(),
-                    "User-Agent": self.user_agent,
-                    "X-Device-Id": self.device_id,
-                },
-            )
-            logger.debug(
-                f"Data: {json_data}, Status code: {response.status_code}, Content: {response.text}"
-            )
-            return response.json()
+            return self.__post_gql(json_data, timeout=timeout, headers=headers)
         except requests.exceptions.RequestException as e:
             logger.error(
                 f"Error with GQLOperations ({json_data['operationName']}): {e}"
@@ -355,6 +400,10 @@ class Twitch(object):
             return False"""
 
     def update_client_version(self):
+        # The twitch.tv page is fetched at most once per CLIENT_VERSION_TTL
+        if time.time() - self.client_version_updated_at < Twitch.CLIENT_VERSION_TTL:
+            return self.client_version
+        self.client_version_updated_at = time.time()
         try:
             response = requests.get(URL)
             if response.status_code != 200:
@@ -691,12 +740,119 @@ class Twitch(object):
             if streamer.settings.community_goals is True:
                 self.contribute_to_community_goals(streamer)
 
+    def refresh_outcomes(self, event):
+        # Fresh outcomes over GQL, PubSub can be late. Wait at most refresh_timeout seconds, else keep the PubSub ones
+        json_data = copy.deepcopy(GQLOperations.ChannelPointsPredictionContext)
+        json_data["variables"]["channelLogin"] = event.streamer.username
+        timeout = event.bet.settings.refresh_timeout
+        started_at = time.time()
+        # The timeout of requests is per socket operation, the whole request is bounded here
+        future = self.refresh_executor.submit(
+            self.__post_gql,
+            json_data,
+            timeout,
+            self.gql_headers(update_version=False),
+        )
+        try:
+            response = future.result(timeout=timeout)
+        except (FutureTimeoutError, requests.exceptions.RequestException) as e:
+            # Expected when Twitch is slow, the request left behind ends with its socket timeout
+            Metrics.histogram("bets.refresh.seconds").observe(time.time() - started_at)
+            logger.debug(
+                f"Outcomes of {event} not refreshed in {timeout}s ({type(e).__name__}), keep the PubSub ones"
+            )
+            Metrics.counter("bets.refresh.fallback").inc()
+            return False
+        Metrics.histogram("bets.refresh.seconds").observe(time.time() - started_at)
+        try:
+            channel = response["data"]["community"]["channel"]
+            predictions = (channel["activePredictionEvents"] or []) + (
+                channel["lockedPredictionEvents"] or []
+            )
+            prediction = next(
+                prediction
+                for prediction in predictions
+                if prediction["id"] == event.event_id
+            )
+            outcomes = {outcome["id"]: outcome for outcome in prediction["outcomes"]}
+            # Same order of the PubSub outcomes. An event-updated received meanwhile is newer, kept
+            if event.bet.updated_at < started_at:
+                event.bet.set_snapshot(
+                    [
+                        {
+                            "total_users": outcomes[outcome.id]["totalUsers"],
+                            "total_points": outcomes[outcome.id]["totalPoints"],
+                            "top_predictors": [
+                                {"points": predictor["points"]}
+                                for predictor in outcomes[outcome.id]["topPredictors"]
+                                or []
+                            ],
+                        }
+                        for outcome in event.bet.outcomes
+                    ],
+                    updated_at=started_at,
+                )
+            Metrics.counter("bets.refresh.fetched").inc()
+            return True
+        except (KeyError, TypeError, StopIteration):
+            logger.debug(f"Unable to refresh the outcomes of {event}, keep the PubSub ones")
+            Metrics.counter("bets.refresh.fallback").inc()
+            return False
+
+    def warm_up(self):
+        # Open (or keep alive) a GQL connection of the session, in background: the prepare never waits for it
+        self.refresh_executor.submit(self.__warm_up)
+
+    def __warm_up(self):
+        # The response doesn't matter
+        try:
+            self.session.head(GQLOperations.url, timeout=Twitch.WARM_UP_TIMEOUT)
+        except requests.exceptions.RequestException as e:
+            logger.debug(f"Unable to warm up the GQL connection: {e}")
+
     def make_predictions(self, event):
+        # Both phases at once, without a scheduler prepare
+        self.prepare_prediction(event)
+        self.commit_prediction(event)
+
+    def prepare_prediction(self, event):
+        # Shortly before the deadline: fresh outcomes and the request, ready to be sent. Runs on its own lane,
+        # the commit doesn't wait for it: nothing here touches the decision, the outcomes go through set_snapshot
+        if event.status != "ACTIVE" or event.bet_placed is True:
+            return
+        if event.bet.settings.refresh_timeout > 0:
+            self.refresh_outcomes(event)
+            event.timeline.mark("refreshed")
+        event.request = self.__prediction_request(event)
+        self.warm_up()
+        event.timeline.mark("prepared")
+
+    def __prediction_request(self, event):
+        # The outcome and the points are set by the commit
+        json_data = copy.deepcopy(GQLOperations.MakePrediction)
+        json_data["variables"] = {
+            "input": {
+                "eventID": event.event_id,
+                "outcomeID": None,
+                "points": 0,
+                "transactionID": token_hex(16),
+            }
+        }
+        return json_data, self.gql_headers(update_version=False)
+
+    def commit_prediction(self, event):
+        # At the deadline: the decision on the latest outcomes, then a single request
+        # Age of the outcomes used for the decision
+        staleness = event.bet.staleness()
+        Metrics.histogram("bets.staleness.seconds").observe(staleness)
         decision = event.bet.calculate(event.streamer.channel_points)
+        event.timeline.mark("decided")
+        # Final decision, the PubSub outcomes are not applied anymore
+        event.bet_placed = True
         # selector_index = 0 if decision["choice"] == "A" else 1
 
         logger.info(
-            f"Going to complete bet for {event}",
+            f"Going to complete bet for {event}, outcomes updated {round(staleness, 1)}s ago",
             extra={
                 "emoji": ":four_leaf_clover:",
                 "event": Events.BET_GENERAL,
@@ -730,16 +886,17 @@ class Twitch(object):
                         },
                     )
 
-                    json_data = copy.deepcopy(GQLOperations.MakePrediction)
-                    json_data["variables"] = {
-                        "input": {
-                            "eventID": event.event_id,
-                            "outcomeID": decision["id"],
-                            "points": decision["amount"],
-                            "transactionID": token_hex(16),
-                        }
-                    }
-                    response = self.post_gql_request(json_data)
+                    # Not prepared (skipped, failed or still running): built now, cheap
+                    json_data, headers = (
+                        event.request
+                        if event.request is not None
+                        else self.__prediction_request(event)
+                    )
+                    json_data["variables"]["input"]["outcomeID"] = decision["id"]
+                    json_data["variables"]["input"]["points"] = decision["amount"]
+                    event.timeline.mark("sent")
+                    response = self.post_gql_request(json_data, headers=headers)
+                    event.timeline.mark("response")
                     if (
                         "data" in response
                         and "makePrediction" in response["data"]
@@ -747,6 +904,7 @@ class Twitch(object):
                         and response["data"]["makePrediction"]["error"] is not None
                     ):
                         error_code = response["data"]["makePrediction"]["error"]["code"]
+                        event.timeline.failed(error_code, event.status)
                         logger.error(
                             f"Failed to place bet, error: {error_code}",
                             extra={
@@ -855,10 +1013,47 @@ class Twitch(object):
                     result.append(r["data"]["user"]["dropCampaign"])
         return result
 
+    def __update_campaigns(self, dashboard):
+        # Only the new campaigns, or with a different endAt, are fetched. The Campaign objects are updated in place
+        dashboard = {campaign["id"]: campaign.get("endAt", None) for campaign in dashboard}
+        for campaign_id in list(self.campaigns_details):
+            if campaign_id not in dashboard:
+                self.campaigns_details.pop(campaign_id)
+                self.campaigns.pop(campaign_id, None)
+
+        changed = [
+            {"id": campaign_id}
+            for campaign_id, end_at in dashboard.items()
+            if end_at is None
+            or campaign_id not in self.campaigns_details
+            or self.campaigns_details[campaign_id][0] != end_at
+        ]
+        for details in self.__get_campaigns_details(changed):
+            if details is not None and details["id"] in dashboard:
+                self.campaigns_details[details["id"]] = (dashboard[details["id"]], details)
+        Metrics.counter("drops.campaigns.fetched").inc(len(changed))
+        Metrics.counter("drops.campaigns.cached").inc(len(dashboard) - len(changed))
+        logger.debug(
+            f"Drops campaigns: {len(dashboard)} active, {len(changed)} new or changed"
+        )
+
+        campaigns = []
+        for campaign_id, (_, details) in self.campaigns_details.items():
+            campaign = self.campaigns.get(campaign_id, None)
+            if campaign is None:
+                campaign = self.campaigns[campaign_id] = Campaign(details)
+            else:
+                campaign.update_details(details)
+            campaigns.append(campaign)
+        return campaigns
+
     def __sync_campaigns(self, campaigns):
         # We need the inventory only for get the real updated value/progress
         # Get data from inventory and sync current status with streamers.campaigns
         inventory = self.__get_inventory()
+        # The Campaign objects are kept across the syncs, in_inventory is set again below
+        for campaign in campaigns:
+            campaign.in_inventory = False
         if inventory not in [None, {}] and inventory["dropCampaignsInProgress"] not in [
             None,
             {},
@@ -940,22 +1135,17 @@ class Twitch(object):
 
                     # Get full details from current ACTIVE campaigns
                     # Use dashboard so we can explore new drops not currently active in our Inventory
-                    campaigns_details = self.__get_campaigns_details(
-                        self.__get_drops_dashboard(status="ACTIVE")
-                    )
                     campaigns = []
 
                     # Going to clear array and structure. Remove all the timeBasedDrops expired or not started yet
-                    for index in range(0, len(campaigns_details)):
-                        if campaigns_details[index] is not None:
-                            campaign = Campaign(campaigns_details[index])
-                            if campaign.dt_match is True:
-                                # Remove all the drops already claimed or with dt not matching
-                                campaign.clear_drops()
-                                if campaign.drops != []:
-                                    campaigns.append(campaign)
-                        else:
-                            continue
+                    for campaign in self.__update_campaigns(
+                        self.__get_drops_dashboard(status="ACTIVE")
+                    ):
+                        if campaign.dt_match is True:
+                            # Remove all the drops already claimed or with dt not matching
+                            campaign.clear_drops()
+                            if campaign.drops != []:
+                                campaigns.append(campaign)
 
                 # Divide et impera :)
                 campaigns = self.__sync_campaigns(campaigns)
@@ -1,62 +1,145 @@
+import asyncio
 import json
 import logging
 import time
 
-from websocket import WebSocketApp, WebSocketConnectionClosedException
+import websockets
+from websockets.exceptions import ConnectionClosed
 
+from TwitchChannelPointsMiner.classes.entities.PubsubTopic import TopicState
 from TwitchChannelPointsMiner.utils import create_nonce
 
 logger = logging.getLogger(__name__)
 
 
-class TwitchWebSocket(WebSocketApp):
-    def __init__(self, index, parent_pool, *args, **kw):
-        super().__init__(*args, **kw)
+class TwitchWebSocket(object):
+    # The connection is not bound to a thread anymore.
+    # All the I/O of every TwitchWebSocket run as coroutines on the event loop owned by the WebSocketsPool
+    def __init__(
+        self,
+        index,
+        parent_pool,
+        url,
+        on_message=None,
+        on_open=None,
+        on_error=None,
+        on_close=None,
+        ssl=None,
+    ):
         self.index = index
+        self.url = url
+
+        self.on_message = on_message
+        self.on_open = on_open
+        self.on_error = on_error
+        self.on_close = on_close
+        self.ssl = ssl
 
         self.parent_pool = parent_pool
+        self.connection = None
+        self.task = None
+        self.ping_task = None
+
         self.is_closed = False
         self.is_opened = False
 
         self.is_reconnecting = False
         self.forced_close = False
 
+        self.opened_at = None
+        self.closed_at = None
+        self.reconnect_started_at = None
+
         # Custom attribute
         self.topics = []
         self.pending_topics = []
+        # str(topic) -> TopicState, the lifecycle of each topic on this connection
+        self.topics_state = {}
+        # nonce -> (LISTEN | UNLISTEN, topics, sent at), matched with the RESPONSE of each request
+        self.pending_nonces = {}
 
         self.twitch = parent_pool.twitch
         self.streamers = parent_pool.streamers
         self.events_predictions = parent_pool.events_predictions
 
-        self.last_message_timestamp = None
-        self.last_message_type_channel = None
-
         self.last_pong = time.time()
         self.last_ping = time.time()
 
-    # def close(self):
-    #     self.forced_close = True
-    #     super().close()
-
-    def listen(self, topic, auth_token=None):
-        data = {"topics": [str(topic)]}
-        if topic.is_user_topic() and auth_token is not None:
-            data["auth_token"] = auth_token
-        nonce = create_nonce()
-        self.send({"type": "LISTEN", "nonce": nonce, "data": data})
+    async def run(self):
+        kwargs = {"ping_interval": None, "max_size": None, "close_timeout": 5}
+        if self.ssl is not None:
+            kwargs["ssl"] = self.ssl
+        try:
+            async with websockets.connect(self.url, **kwargs) as connection:
+                self.connection = connection
+                if self.on_open is not None:
+                    self.on_open(self)
+                async for message in connection:
+                    self.on_message(self, message)
+        except ConnectionClosed as e:
+            if self.forced_close is False and self.on_error is not None:
+                self.on_error(self, e)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            if self.on_error is not None:
+                self.on_error(self, e)
+        finally:
+            self.is_closed = True
+            self.closed_at = time.time()
+            if self.ping_task is not None:
+                self.ping_task.cancel()
+            if self.on_close is not None:
+                self.on_close(self, None, None)
+
+    def listen(self, topics, auth_token=None):
+        self.__request("LISTEN", topics, auth_token, TopicState.SUBSCRIBING)
+
+    def unlisten(self, topics, auth_token=None):
+        self.__request("UNLISTEN", topics, auth_token, TopicState.UNSUBSCRIBING)
+
+    def __request(self, request_type, topics, auth_token, state):
+        # A single request can carry multiple topics, only the user topics need the auth_token
+        topics = topics if isinstance(topics, list) else [topics]
+        user_topics = [topic for topic in topics if topic.is_user_topic()]
+        channel_topics = [topic for topic in topics if not topic.is_user_topic()]
+        for group, token in [(user_topics, auth_token), (channel_topics, None)]:
+            if group != []:
+                data = {"topics": [str(topic) for topic in group]}
+                if token is not None:
+                    data["auth_token"] = token
+                for topic in group:
+                    self.topics_state[str(topic)] = state
+                nonce = create_nonce()
+                self.pending_nonces[nonce] = (request_type, group, time.time())
+                self.send({"type": request_type, "nonce": nonce, "data": data})
 
     def ping(self):
         self.send({"type": "PING"})
         self.last_ping = time.time()
 
+    # Thread-safe, can be called from the event loop or from any other thread
     def send(self, request):
-        try:
-            request_str = json.dumps(request, separators=(",", ":"))
+        request_str = json.dumps(request, separators=(",", ":"))
+        if logger.isEnabledFor(logging.DEBUG):
             logger.debug(f"#{self.index} - Send: {request_str}")
-            super().send(request_str)
-        except WebSocketConnectionClosedException:
+        asyncio.run_coroutine_threadsafe(self.__send(request_str), self.parent_pool.loop)
+
+    async def __send(self, request_str):
+        if self.connection is None:
             self.is_closed = True
+            return
+        try:
+            await self.connection.send(request_str)
+        except ConnectionClosed:
+            self.is_closed = True
+
+    def close(self):
+        if self.connection is not None:
+            asyncio.run_coroutine_threadsafe(self.connection.close(), self.parent_pool.loop)
+        elif self.task is not None:
+            # Still connecting, nothing to close gracefully
+            self.task.cancel()
 
     def elapsed_last_pong(self):
         return (time.time() - self.last_pong) // 60
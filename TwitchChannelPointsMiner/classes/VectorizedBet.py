@@ -0,0 +1,263 @@
+import numpy as np
+
+from TwitchChannelPointsMiner.classes.entities.Bet import Condition, OutcomeKeys, Strategy
+
+# Bet.calculate and Bet.skip vectorized with NumPy, on many predictions at once.
+# Used by the shadow evaluation of the strategies and by prediction_backtest.py
+
+NUMBER_STRATEGIES = {
+    Strategy.NUMBER_1: 0,
+    Strategy.NUMBER_2: 1,
+    Strategy.NUMBER_3: 2,
+    Strategy.NUMBER_4: 3,
+    Strategy.NUMBER_5: 4,
+    Strategy.NUMBER_6: 5,
+    Strategy.NUMBER_7: 6,
+    Strategy.NUMBER_8: 7,
+}
+
+
+class Predictions(object):
+    # The recorded columns and the values derived once for all the combinations, same as Bet.__derive
+
+    __slots__ = [
+        "size",
+        "count",
+        "valid",
+        "rows",
+        "balance",
+        "total_users",
+        "total_points",
+        "values",
+        "winner",
+        "final_points",
+        "final_total",
+        "recorded_gained",
+    ]
+
+    def __init__(self, columns):
+        self.count = columns["outcomes"].astype(np.int64)
+        self.size = len(self.count)
+        self.rows = np.arange(self.size)
+        self.valid = (
+            np.arange(columns["users"].shape[1])[None, :] < self.count[:, None]
+        )
+        self.balance = columns["balance"]
+
+        users = np.where(self.valid, columns["users"], 0)
+        points = np.where(self.valid, columns["points"], 0)
+        self.total_users = users.sum(axis=1)
+        self.total_points = points.sum(axis=1)
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            data = ((self.total_users > 0) & (self.total_points > 0))[:, None]
+            percentage_users = np.round(100 * users / self.total_users[:, None], 2)
+            odds = np.where(
+                points > 0,
+                np.round(np.minimum(self.total_points[:, None] / points, 1000), 2),
+                999,
+            )
+            odds_percentage = np.round(np.clip(100 / odds, 0.1, 100), 2)
+            # Not enough data: default safe values
+            two = (self.count == 2)[:, None]
+            default_percentage = np.where(two, 50.0, 100.0 / self.count[:, None])
+            default_odds = np.where(two, 2.0, self.count[:, None])
+
+        self.values = {
+            OutcomeKeys.TOTAL_USERS: users,
+            OutcomeKeys.TOTAL_POINTS: points,
+            OutcomeKeys.TOP_POINTS: np.where(self.valid, columns["top_points"], 0),
+            OutcomeKeys.PERCENTAGE_USERS: np.where(
+                data, percentage_users, default_percentage
+            ),
+            OutcomeKeys.ODDS: np.where(data, odds, default_odds),
+            OutcomeKeys.ODDS_PERCENTAGE: np.where(
+                data, odds_percentage, default_percentage
+            ),
+        }
+
+        # Result: the final points without our own bet
+        self.winner = columns["winner"].astype(np.int64)
+        placed = columns["placed"].astype(np.int64)
+        final_points = np.where(self.valid, columns["final_points"], 0)
+        really_placed = placed >= 0
+        final_points[self.rows[really_placed], placed[really_placed]] -= columns[
+            "placed_amount"
+        ][really_placed]
+        self.final_points = np.maximum(final_points, 0)
+        self.final_total = self.final_points.sum(axis=1)
+        self.recorded_gained = self.gained(
+            np.where(really_placed, placed, -1), columns["placed_amount"][None, :]
+        )[0]
+
+    def outcome(self, key, choice):
+        # Value of the chosen outcome for each prediction
+        return self.values[key][self.rows, np.maximum(choice, 0)]
+
+    def gained(self, choice, amount):
+        # choice (N), amount (M, N) -> points gained (M, N), 0 when no bet
+        winner_points = self.final_points[self.rows, np.maximum(choice, 0)]
+        payout = np.floor(
+            amount * (self.final_total + amount) / np.maximum(winner_points + amount, 1)
+        )
+        gained = np.where(choice == self.winner, payout - amount, -amount)
+        # Cancelled: refunded
+        gained = np.where(self.winner < 0, 0, gained)
+        return np.where(choice >= 0, gained, 0)
+
+
+def return_choice(predictions, key):
+    # Bet.__return_choice: the highest value, the ties broken by users/points
+    values = np.where(predictions.valid, predictions.values[key], -np.inf)
+    largest_value = values.max(axis=1)[:, None]
+    if key in [OutcomeKeys.PERCENTAGE_USERS, OutcomeKeys.ODDS_PERCENTAGE]:
+        tied = np.abs(values - largest_value) <= 2
+    else:
+        tied = values == largest_value
+    tied &= predictions.valid
+
+    user_factor = predictions.values[OutcomeKeys.TOTAL_USERS] / np.maximum(
+        predictions.total_users, 1
+    )[:, None]
+    points_factor = predictions.values[OutcomeKeys.TOTAL_POINTS] / np.maximum(
+        predictions.total_points, 1
+    )[:, None]
+    if key in [OutcomeKeys.ODDS, OutcomeKeys.ODDS_PERCENTAGE]:
+        score = user_factor * 0.7 + points_factor * 0.3
+    else:
+        score = points_factor * 0.6 + user_factor * 0.4
+    # Without ties the largest is the only tied outcome
+    return np.argmax(np.where(tied, score, -np.inf), axis=1)
+
+
+def return_choice_smart_money(predictions):
+    top_points = predictions.values[OutcomeKeys.TOP_POINTS].astype(np.float64)
+    users = predictions.values[OutcomeKeys.TOTAL_USERS]
+    points = predictions.values[OutcomeKeys.TOTAL_POINTS]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        average_bet = np.where(users > 0, points / users, 0)
+        ratio = np.where(average_bet > 0, top_points / average_bet, 1)
+    smart_score = top_points * (1 + np.minimum(ratio / 10, 2))
+    choice = np.argmax(np.where(predictions.valid, smart_score, -np.inf), axis=1)
+    any_top_points = (predictions.valid & (top_points > 0)).any(axis=1)
+    return np.where(
+        any_top_points, choice, return_choice(predictions, OutcomeKeys.TOTAL_POINTS)
+    )
+
+
+def return_choice_balanced(predictions):
+    total_points = predictions.total_points[:, None]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        points_score = np.where(
+            total_points > 0,
+            predictions.values[OutcomeKeys.TOTAL_POINTS] / total_points,
+            0,
+        )
+    score = (
+        (predictions.values[OutcomeKeys.PERCENTAGE_USERS] / 100) * 0.4
+        + points_score * 0.3
+        + np.minimum(predictions.values[OutcomeKeys.ODDS] / 3, 1) * 0.3
+    )
+    return np.argmax(np.where(predictions.valid, score, -np.inf), axis=1)
+
+
+def return_choice_smart(predictions, percentage_gap):
+    percentage_users = predictions.values[OutcomeKeys.PERCENTAGE_USERS]
+    points = predictions.values[OutcomeKeys.TOTAL_POINTS]
+    user_diff = np.abs(percentage_users[:, 0] - percentage_users[:, 1])
+    total_points = np.where(predictions.total_points > 0, predictions.total_points, 1)
+    points_diff_percentage = (np.abs(points[:, 0] - points[:, 1]) / total_points) * 100
+    data_confidence = np.minimum(predictions.total_users / 100, 1.0)
+    consensus_factor = (user_diff + points_diff_percentage) / 2
+    effective_gap = percentage_gap * (2 - data_confidence)
+
+    # Low consensus: odds, unless they look like a value trap
+    odds_choice = return_choice(predictions, OutcomeKeys.ODDS)
+    low_consensus = np.where(
+        predictions.outcome(OutcomeKeys.ODDS, odds_choice) < 1.15,
+        return_choice_balanced(predictions),
+        odds_choice,
+    )
+    # High consensus: the crowd, if smart money agrees
+    crowd_choice = return_choice(predictions, OutcomeKeys.TOTAL_USERS)
+    high_consensus = np.where(
+        crowd_choice == return_choice_smart_money(predictions),
+        crowd_choice,
+        return_choice(predictions, OutcomeKeys.TOTAL_POINTS),
+    )
+    return np.where(consensus_factor < effective_gap, low_consensus, high_consensus)
+
+
+def calculate_choice(predictions, strategy, percentage_gap=20):
+    # Bet.calculate, the choice only: -1 when there is no bet
+    if strategy == Strategy.MOST_VOTED:
+        choice = return_choice(predictions, OutcomeKeys.TOTAL_USERS)
+    elif strategy == Strategy.HIGH_ODDS:
+        choice = return_choice(predictions, OutcomeKeys.ODDS)
+    elif strategy == Strategy.PERCENTAGE:
+        choice = return_choice(predictions, OutcomeKeys.ODDS_PERCENTAGE)
+    elif strategy == Strategy.SMART_MONEY:
+        choice = return_choice_smart_money(predictions)
+    elif strategy == Strategy.SMART:
+        choice = return_choice_smart(predictions, percentage_gap)
+    else:
+        number = NUMBER_STRATEGIES[strategy]
+        choice = np.where(predictions.count > number, number, 0)
+
+    # Bet.__is_bet_worthwhile
+    percentage_users = np.where(
+        predictions.valid, predictions.values[OutcomeKeys.PERCENTAGE_USERS], -np.inf
+    )
+    odds = np.where(predictions.valid, predictions.values[OutcomeKeys.ODDS], np.inf)
+    worthwhile = (
+        (predictions.total_users >= 10)
+        & (predictions.total_points >= 100)
+        & (percentage_users.max(axis=1) <= 95)
+        & ~(odds < 1.05).all(axis=1)
+        & ~(
+            (predictions.outcome(OutcomeKeys.ODDS, choice) < 1.1)
+            & (predictions.outcome(OutcomeKeys.PERCENTAGE_USERS, choice) > 80)
+        )
+    )
+    enough_data = (predictions.count >= 2) & (predictions.total_users >= 10)
+    return np.where(enough_data & worthwhile, choice, -1)
+
+
+def calculate_amount(predictions, choice, percentage, max_points, stealth_mode):
+    # Bet.calculate, the amount: percentage, max_points and stealth_mode are (M) arrays -> (M, N)
+    amount = np.minimum(
+        np.trunc(predictions.balance[None, :] * (percentage[:, None] / 100)),
+        max_points[:, None],
+    )
+    top_points = predictions.outcome(OutcomeKeys.TOP_POINTS, choice)[None, :]
+    # The random reduction of stealth_mode replaced by its average
+    stealth = stealth_mode[:, None] & (amount >= top_points) & (top_points > 0)
+    reduced = np.maximum(np.trunc(top_points - np.maximum(top_points * 0.05, 5.5)), 10)
+    return np.where(stealth, reduced, amount)
+
+
+def skip(predictions, choice, filter_condition):
+    # Bet.skip: True when the bet is skipped
+    if filter_condition is None:
+        return np.zeros(predictions.size, dtype=bool)
+    key = filter_condition.by
+    fixed_key = (
+        key
+        if key not in [OutcomeKeys.DECISION_USERS, OutcomeKeys.DECISION_POINTS]
+        else key.replace("decision", "total")
+    )
+    if key in [OutcomeKeys.TOTAL_USERS, OutcomeKeys.TOTAL_POINTS]:
+        values = predictions.values[fixed_key]
+        compared_value = values[:, 0] + values[:, 1]
+    else:
+        compared_value = predictions.outcome(fixed_key, choice)
+
+    value = filter_condition.value
+    where = filter_condition.where
+    if where == Condition.GT:
+        return ~(compared_value > value)
+    elif where == Condition.LT:
+        return ~(compared_value < value)
+    elif where == Condition.GTE:
+        return ~(compared_value >= value)
+    return ~(compared_value <= value)
@@ -1,36 +1,122 @@
+import asyncio
 import json
 import logging
 import random
+import re
 import time
 # import os
-from threading import Thread, Timer
+from queue import Queue
+from threading import RLock, Thread
 # from pathlib import Path
 
-from dateutil import parser
-
-from TwitchChannelPointsMiner.classes.entities.CommunityGoal import CommunityGoal
-from TwitchChannelPointsMiner.classes.entities.EventPrediction import EventPrediction
+from TwitchChannelPointsMiner.classes.BetScheduler import BetScheduler
 from TwitchChannelPointsMiner.classes.entities.Message import Message
-from TwitchChannelPointsMiner.classes.entities.Raid import Raid
-from TwitchChannelPointsMiner.classes.Settings import Events, Settings
+from TwitchChannelPointsMiner.classes.entities.PubsubTopic import TopicState
+from TwitchChannelPointsMiner.classes.Metrics import Metrics
+from TwitchChannelPointsMiner.classes.PubSubDeduplicator import PubSubDeduplicator
+from TwitchChannelPointsMiner.classes.PubSubHandlers import HandlersRegistry
+from TwitchChannelPointsMiner.classes.ServerClock import ServerClock
+from TwitchChannelPointsMiner.classes.Settings import Settings
 from TwitchChannelPointsMiner.classes.TwitchWebSocket import TwitchWebSocket
+from TwitchChannelPointsMiner.classes.WorkerPool import OrderedWorkerPool
 from TwitchChannelPointsMiner.constants import WEBSOCKET
-from TwitchChannelPointsMiner.utils import (
-    get_streamer_index,
-    internet_connection_available,
-)
+from TwitchChannelPointsMiner.utils import internet_connection_available
 
 logger = logging.getLogger(__name__)
 
+# The topic of the envelope. The payload is an escaped string, its keys are never matched
+TOPIC_PATTERN = re.compile(r'"topic":\s*"([^".]+)')
 
-class WebSocketsPool:
-    __slots__ = ["ws", "twitch", "streamers", "events_predictions"]
 
-    def __init__(self, twitch, streamers, events_predictions):
+class WebSocketsPool:
+    __slots__ = [
+        "ws",
+        "twitch",
+        "streamers",
+        "streamers_index",
+        "events_predictions",
+        "handlers",
+        "loop",
+        "bridge",
+        "deduplicator",
+        "workers",
+        "fast_lane",
+        "placement_lock",
+        "recorder",
+        "bet_scheduler",
+    ]
+
+    def __init__(
+        self,
+        twitch,
+        streamers,
+        events_predictions,
+        handlers=None,
+        recorder=None,
+        bet_scheduler=None,
+    ):
         self.ws = []
         self.twitch = twitch
         self.streamers = streamers
+        # channel_id -> Streamer, used for the O(1) lookup of each incoming message
+        self.streamers_index = {
+            str(streamer.channel_id): streamer for streamer in streamers
+        }
         self.events_predictions = events_predictions
+        # (topic, message type) -> handler. Extensible with self.handlers.register(...)
+        self.handlers = HandlersRegistry.default() if handlers is None else handlers
+        # Started with the first connection, see __start_runtime
+        self.loop = None
+        # Thread-safe bridge between the event loop and the handlers
+        self.bridge = Queue()
+        # Shared by all the connections
+        self.deduplicator = PubSubDeduplicator()
+        # The handlers run here, with the order preserved for each streamer
+        self.workers = OrderedWorkerPool("default", workers=4)
+        self.fast_lane = OrderedWorkerPool("fast", workers=2)
+        # Topics placement can be changed by the main thread and by the reconnections on the event loop
+        self.placement_lock = RLock()
+        # Optional PubSubRecorder, all the received frames are written before the dispatch
+        self.recorder = recorder
+        # The bets of the predictions are placed by the scheduler, when they are due
+        if bet_scheduler is None:
+            bet_scheduler = BetScheduler(twitch.make_predictions)
+            bet_scheduler.start()
+        self.bet_scheduler = bet_scheduler
+
+    def add_streamer(self, streamer):
+        if streamer not in self.streamers:
+            self.streamers.append(streamer)
+        self.streamers_index[str(streamer.channel_id)] = streamer
+
+    def remove_streamer(self, streamer):
+        if streamer in self.streamers:
+            self.streamers.remove(streamer)
+        self.streamers_index.pop(str(streamer.channel_id), None)
+        self.unsubscribe(streamer)
+
+    def unsubscribe(self, streamer):
+        # Release the topics of the streamer and compact the connections
+        with self.placement_lock:
+            index = self.__find_owner(str(streamer.channel_id))
+            if index is not None:
+                self.__release(
+                    index, self.__owned_topics(index, str(streamer.channel_id))
+                )
+                self.rebalance()
+
+    def unsubmit(self, topics):
+        # Stop listening for some topics (e.g. a setting disabled), the other topics of the streamer stay
+        topics = topics if isinstance(topics, list) else [topics]
+        with self.placement_lock:
+            for index in range(0, len(self.ws)):
+                released = [topic for topic in topics if topic in self.ws[index].topics]
+                if released != []:
+                    self.__release(index, released)
+            self.rebalance()
+
+    def get_streamer(self, channel_id):
+        return self.streamers_index.get(str(channel_id), None)
 
     """
     API Limits
@@ -39,87 +125,278 @@ class WebSocketsPool:
     The two limits above are likely to be relaxed for approved third-party applications, as we start to better understand third-party requirements.
     """
 
-    def submit(self, topic):
-        # Check if we need to create a new WebSocket instance
-        if self.ws == [] or len(self.ws[-1].topics) >= 50:
+    MAX_TOPICS = 50
+    MAX_CONNECTIONS = 10
+
+    # Seconds, exponential backoff with jitter between the reconnection attempts
+    RECONNECT_BASE_DELAY = 1
+    RECONNECT_MAX_DELAY = 120
+    RECONNECT_OPEN_TIMEOUT = 15
+
+    def submit(self, topics) -> bool:
+        # Accept a single topic or a list. The topics of a streamer are always placed on the same connection
+        topics = topics if isinstance(topics, list) else [topics]
+        groups = {}
+        for topic in topics:
+            groups.setdefault(topic.owner(), []).append(topic)
+
+        placed = True
+        with self.placement_lock:
+            for owner, group in groups.items():
+                placed = self.__place(owner, group) and placed
+        return placed
+
+    def __place(self, owner, topics):
+        index = self.__find_owner(owner)
+        if index is not None:
+            topics = [topic for topic in topics if topic not in self.ws[index].topics]
+            if topics == []:
+                return True
+            if len(self.ws[index].topics) + len(topics) <= WebSocketsPool.MAX_TOPICS:
+                for topic in topics:
+                    self.__submit(index, topic)
+                return True
+
+        # New group, or the current connection is full: the whole group goes on the best fitting connection
+        size = len(topics) + (
+            0 if index is None else len(self.__owned_topics(index, owner))
+        )
+        target = self.__best_fit(size, exclude=index)
+        if target is None:
+            if len(self.ws) >= WebSocketsPool.MAX_CONNECTIONS:
+                Metrics.counter("pubsub.topics.overflow").inc(len(topics))
+                logger.warning(
+                    f"Unable to listen for {', '.join(str(topic) for topic in topics)}: "
+                    f"all the {WebSocketsPool.MAX_CONNECTIONS} connections are full"
+                )
+                return False
             self.ws.append(self.__new(len(self.ws)))
-            self.__start(-1)
+            self.__start(self.ws[-1])
+            target = len(self.ws) - 1
 
-        self.__submit(-1, topic)
+        if index is not None:
+            topics = (
+                self.__release(index, self.__owned_topics(index, owner)) + topics
+            )
+            logger.debug(
+                f"Moved {len(topics)} topics of {owner} from #{index} to #{target}"
+            )
 
-    def __submit(self, index, topic):
-        # Topic in topics should never happen. Anyway prevent any types of duplicates
-        if topic not in self.ws[index].topics:
-            self.ws[index].topics.append(topic)
+        for topic in topics:
+            self.__submit(target, topic)
+        return True
 
-        if self.ws[index].is_opened is False:
-            self.ws[index].pending_topics.append(topic)
-        else:
-            self.ws[index].listen(topic, self.twitch.twitch_login.get_auth_token())
+    def __find_owner(self, owner):
+        for index in range(0, len(self.ws)):
+            for topic in self.ws[index].topics:
+                if topic.owner() == owner:
+                    return index
+        return None
+
+    def __owned_topics(self, index, owner):
+        return [topic for topic in self.ws[index].topics if topic.owner() == owner]
+
+    def __best_fit(self, size, exclude=None, free=None):
+        # The fullest connection that still has room for `size` topics
+        free = (
+            [WebSocketsPool.MAX_TOPICS - len(ws.topics) for ws in self.ws]
+            if free is None
+            else free
+        )
+        candidates = [
+            index
+            for index in range(0, len(free))
+            if index != exclude and free[index] >= size
+        ]
+        return None if candidates == [] else min(candidates, key=lambda i: free[i])
+
+    def __release(self, index, topics):
+        # Forget the topics, UNLISTEN the ones already sent to the server
+        ws = self.ws[index]
+        ws.topics = [topic for topic in ws.topics if topic not in topics]
+        ws.pending_topics = [topic for topic in ws.pending_topics if topic not in topics]
+        listened = []
+        for topic in topics:
+            state = ws.topics_state.get(str(topic), None)
+            if state in [TopicState.SUBSCRIBING, TopicState.ACTIVE]:
+                listened.append(topic)
+            elif state is not None and state != TopicState.UNSUBSCRIBING:
+                del ws.topics_state[str(topic)]
+        if listened != [] and ws.is_opened is True and ws.is_closed is False:
+            ws.unlisten(listened, self.twitch.twitch_login.get_auth_token())
+        return topics
+
+    def rebalance(self):
+        with self.placement_lock:
+            return self.__rebalance()
+
+    def __rebalance(self):
+        # Pack the topics of the least loaded connection on the others, then close it
+        if len(self.ws) < 2 or any(ws.is_reconnecting for ws in self.ws):
+            return None
+        total = sum(len(ws.topics) for ws in self.ws)
+        if total > WebSocketsPool.MAX_TOPICS * (len(self.ws) - 1):
+            return None
+
+        source = min(range(0, len(self.ws)), key=lambda i: len(self.ws[i].topics))
+        groups = {}
+        for topic in self.ws[source].topics:
+            groups.setdefault(topic.owner(), []).append(topic)
+
+        # Biggest groups first, every group must fit or nothing is moved
+        free = [WebSocketsPool.MAX_TOPICS - len(ws.topics) for ws in self.ws]
+        plan = []
+        for group in sorted(groups.values(), key=len, reverse=True):
+            target = self.__best_fit(len(group), exclude=source, free=free)
+            if target is None:
+                return None
+            free[target] -= len(group)
+            plan.append((target, group))
+
+        # Make before break, the duplicated messages are dropped by the deduplicator
+        for target, group in plan:
+            for topic in group:
+                self.__submit(target, topic)
+
+        drained = self.ws.pop(source)
+        drained.forced_close = True
+        drained.close()
+        for index in range(0, len(self.ws)):
+            self.ws[index].index = index
+        logger.info(
+            f"#{source} - Moved {len(drained.topics)} topics on the other connections, {len(self.ws)} connections left"
+        )
+        return drained
+
+    def __submit(self, index, topic):
+        # Under the lock: on_open (event loop) must not send the pending topics between the check and the append
+        with self.placement_lock:
+            ws = self.ws[index]
+            # Topic in topics should never happen. Anyway prevent any types of duplicates
+            if topic not in ws.topics:
+                ws.topics.append(topic)
+
+            if ws.is_opened is False:
+                ws.pending_topics.append(topic)
+                ws.topics_state[str(topic)] = TopicState.PENDING
+                return
+        ws.listen(topic, self.twitch.twitch_login.get_auth_token())
 
     def __new(self, index):
         return TwitchWebSocket(
             index=index,
             parent_pool=self,
             url=WEBSOCKET,
-            on_message=WebSocketsPool.on_message,
+            on_message=WebSocketsPool.on_receive,
             on_open=WebSocketsPool.on_open,
             on_error=WebSocketsPool.on_error,
-            on_close=WebSocketsPool.on_close
+            on_close=WebSocketsPool.on_close,
             # on_close=WebSocketsPool.handle_reconnection, # Do nothing.
+            ssl=self.__ssl_context(),
         )
 
-    def __start(self, index):
+    def __ssl_context(self):
         if Settings.disable_ssl_cert_verification is True:
             import ssl
 
-            thread_ws = Thread(
-                target=lambda: self.ws[index].run_forever(
-                    sslopt={"cert_reqs": ssl.CERT_NONE}
+            context = ssl.create_default_context()
+            context.check_hostname = False
+            context.verify_mode = ssl.CERT_NONE
+            return context
+        return None
+
+    def __start_runtime(self):
+        # A single event loop runs all the connections, their pings and reconnections
+        self.loop = asyncio.new_event_loop()
+        loop_thread = Thread(target=self.loop.run_forever)
+        loop_thread.daemon = True
+        loop_thread.name = "PubSub event loop"
+        loop_thread.start()
+
+        # Decode the messages outside the event loop, the handlers run on the workers
+        bridge_thread = Thread(target=self.__dispatch)
+        bridge_thread.daemon = True
+        bridge_thread.name = "PubSub dispatcher"
+        bridge_thread.start()
+
+        if Settings.disable_ssl_cert_verification is True:
+            logger.warning("SSL certificate verification is disabled! Be aware!")
+
+    def __start(self, ws):
+        if self.loop is None:
+            self.__start_runtime()
+        ws.task = self.run_coroutine(ws.run())
+
+    def run_coroutine(self, coroutine):
+        # Thread-safe, schedule a coroutine on the PubSub event loop
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+    def __dispatch(self):
+        while True:
+            item = self.bridge.get()
+            if item is None:
+                break
+            ws, message, received_at = item
+            try:
+                if self.recorder is not None:
+                    self.recorder.record(ws.index, message, received_at)
+                WebSocketsPool.on_message(ws, message, received_at)
+            except Exception:
+                logger.error(
+                    f"#{ws.index} - Exception raised while handling: {message}",
+                    exc_info=True,
                 )
-            )
-            logger.warn("SSL certificate verification is disabled! Be aware!")
-        else:
-            thread_ws = Thread(target=lambda: self.ws[index].run_forever())
-        thread_ws.daemon = True
-        thread_ws.name = f"WebSocket #{self.ws[index].index}"
-        thread_ws.start()
 
     def end(self):
         for index in range(0, len(self.ws)):
             self.ws[index].forced_close = True
             self.ws[index].close()
+        self.bridge.put(None)
+        self.workers.stop()
+        self.fast_lane.stop()
+        if self.recorder is not None:
+            self.recorder.close()
+        self.bet_scheduler.stop()
+
+    @staticmethod
+    def on_receive(ws, message):
+        # Called on the event loop, hand the message to the dispatcher thread
+        ws.parent_pool.bridge.put((ws, message, time.time()))
 
     @staticmethod
     def on_open(ws):
-        def run():
+        with ws.parent_pool.placement_lock:
             ws.is_opened = True
-            ws.ping()
-
-            for topic in ws.pending_topics:
-                ws.listen(topic, ws.twitch.twitch_login.get_auth_token())
+            # Taken once, a reopen doesn't LISTEN them again
+            topics, ws.pending_topics = ws.pending_topics, []
+        ws.opened_at = time.time()
+        ws.ping()
 
-            while ws.is_closed is False:
-                # Else: the ws is currently in reconnecting phase, you can't do ping or other operation.
-                # Probably this ws will be closed very soon with ws.is_closed = True
-                if ws.is_reconnecting is False:
-                    ws.ping()  # We need ping for keep the connection alive
-                    time.sleep(random.uniform(25, 30))
+        ws.listen(topics, ws.twitch.twitch_login.get_auth_token())
 
-                    if ws.elapsed_last_pong() > 5:
-                        logger.info(
-                            f"#{ws.index} - The last PONG was received more than 5 minutes ago"
-                        )
-                        WebSocketsPool.handle_reconnection(ws)
+        ws.ping_task = asyncio.ensure_future(WebSocketsPool.ping_loop(ws))
 
-        thread_ws = Thread(target=run)
-        thread_ws.daemon = True
-        thread_ws.start()
+    @staticmethod
+    async def ping_loop(ws):
+        while ws.is_closed is False:
+            # Else: the ws is currently in reconnecting phase, you can't do ping or other operation.
+            # Probably this ws will be closed very soon with ws.is_closed = True
+            if ws.is_reconnecting is False:
+                ws.ping()  # We need ping for keep the connection alive
+                await asyncio.sleep(random.uniform(25, 30))
+
+                if ws.elapsed_last_pong() > 5:
+                    logger.info(
+                        f"#{ws.index} - The last PONG was received more than 5 minutes ago"
+                    )
+                    WebSocketsPool.handle_reconnection(ws)
+            else:
+                await asyncio.sleep(1)
 
     @staticmethod
     def on_error(ws, error):
         # Connection lost | [WinError 10054] An existing connection was forcibly closed by the remote host
-        # Connection already closed | Connection is already closed (raise WebSocketConnectionClosedException)
+        # Connection already closed | Connection is already closed (raise ConnectionClosed)
         logger.error(f"#{ws.index} - WebSocket error: {error}")
 
     @staticmethod
@@ -129,307 +406,204 @@ class WebSocketsPool:
         WebSocketsPool.handle_reconnection(ws)
 
     @staticmethod
-    def handle_reconnection(ws):
+    def handle_reconnection(ws, immediate=False):
         # Reconnect only if ws.is_reconnecting is False to prevent more than 1 ws from being created
         if ws.is_reconnecting is False:
-            # Close the current WebSocket.
-            ws.is_closed = True
-            ws.keep_running = False
-            # Reconnect only if ws.forced_close is False (replace the keep_running)
-
             # Set the current socket as reconnecting status
             # So the external ping check will be locked
             ws.is_reconnecting = True
+            ws.reconnect_started_at = time.time()
 
+            # Reconnect only if ws.forced_close is False (replace the keep_running)
             if ws.forced_close is False:
+                # Thread-safe, the reconnection is scheduled on the event loop and never blocks the caller
+                ws.parent_pool.run_coroutine(WebSocketsPool.reconnect(ws, immediate))
+            else:
+                ws.close()
+
+    @staticmethod
+    async def reconnect(ws, immediate=False):
+        self = ws.parent_pool
+        loop = asyncio.get_event_loop()
+        attempt = 0
+        while ws.forced_close is False:
+            # Exponential backoff with full jitter. RECONNECT messages ask for a new connection right now
+            if attempt > 0 or immediate is False:
+                delay = random.uniform(
+                    0,
+                    min(
+                        WebSocketsPool.RECONNECT_MAX_DELAY,
+                        WebSocketsPool.RECONNECT_BASE_DELAY * (2 ** attempt),
+                    ),
+                )
                 logger.info(
-                    f"#{ws.index} - Reconnecting to Twitch PubSub server in ~60 seconds"
+                    f"#{ws.index} - Reconnecting to Twitch PubSub server in {round(delay, 1)}s (attempt {attempt + 1})"
                 )
-                time.sleep(30)
+                await asyncio.sleep(delay)
+            attempt += 1
+            Metrics.counter("pubsub.reconnect.attempts").inc()
 
-                while internet_connection_available() is False:
-                    random_sleep = random.randint(1, 3)
-                    logger.warning(
-                        f"#{ws.index} - No internet connection available! Retry after {random_sleep}m"
-                    )
-                    time.sleep(random_sleep * 60)
+            if (
+                await loop.run_in_executor(None, internet_connection_available)
+            ) is False:
+                logger.warning(f"#{ws.index} - No internet connection available!")
+                continue
+
+            # Make before break: the new connection subscribes all the topics before the old one is closed
+            candidate = self.__new(ws.index)
+            candidate.topics = list(ws.topics)
+            candidate.pending_topics = list(ws.topics)
+            # Until promoted, a failure of the candidate is handled by this loop
+            candidate.is_reconnecting = True
+            self.__start(candidate)
+
+            opened_before = time.time() + WebSocketsPool.RECONNECT_OPEN_TIMEOUT
+            while (
+                candidate.is_opened is False
+                and candidate.is_closed is False
+                and time.time() < opened_before
+            ):
+                await asyncio.sleep(0.1)
 
-                # Why not create a new ws on the same array index? Let's try.
-                self = ws.parent_pool
-                # Create a new connection.
-                self.ws[ws.index] = self.__new(ws.index)
+            if candidate.is_opened is False or candidate.is_closed is True:
+                candidate.forced_close = True
+                candidate.close()
+                continue
 
-                self.__start(ws.index)  # Start a new thread.
-                time.sleep(30)
+            if ws.forced_close is True:
+                candidate.forced_close = True
+                candidate.close()
+                return
 
+            with self.placement_lock:
+                candidate.is_reconnecting = False
+                candidate.index = ws.index
+                self.ws[ws.index] = candidate
+                # Topics submitted while the candidate was connecting
                 for topic in ws.topics:
-                    self.__submit(ws.index, topic)
+                    if topic not in candidate.topics:
+                        self.__submit(ws.index, topic)
+
+            # Coverage gap: the time without any open connection for these topics
+            gap = (
+                0
+                if ws.closed_at is None
+                else max(candidate.opened_at - ws.closed_at, 0)
+            )
+            Metrics.histogram("pubsub.reconnect.seconds").observe(
+                time.time() - ws.reconnect_started_at
+            )
+            Metrics.histogram("pubsub.reconnect.gap.seconds").observe(gap)
+            logger.info(
+                f"#{ws.index} - Reconnected to Twitch PubSub server in {round(time.time() - ws.reconnect_started_at, 2)}s, messages gap: {round(gap, 2)}s"
+            )
+
+            ws.forced_close = True
+            ws.close()
+
+            with self.placement_lock:
+                # Topics released while the candidate was connecting
+                released = [
+                    topic for topic in candidate.topics if topic not in ws.topics
+                ]
+                if released != []:
+                    self.__release(candidate.index, released)
+                # Streamers removed during the reconnections, maybe now we need less connections
+                self.rebalance()
+            return
 
     @staticmethod
-    def on_message(ws, message):
-        logger.debug(f"#{ws.index} - Received: {message.strip()}")
+    def on_message(ws, message, received_at=None):
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"#{ws.index} - Received: {message.strip()}")
+
+        # Route from the topic string, the frames without any handler are never decoded
+        match = TOPIC_PATTERN.search(message)
+        if (
+            match is not None
+            and ws.parent_pool.handlers.handles_topic(match.group(1)) is False
+        ):
+            Metrics.counter("pubsub.messages.unhandled").inc()
+            return
+
         response = json.loads(message)
 
         if response["type"] == "MESSAGE":
             # We should create a Message class ...
             message = Message(response["data"])
+            message.received_at = received_at
 
-            # If we have more than one PubSub connection, messages may be duplicated
-            # Check the concatenation between message_type.top.channel_id
-            if (
-                ws.last_message_type_channel is not None
-                and ws.last_message_timestamp is not None
-                and ws.last_message_timestamp == message.timestamp
-                and ws.last_message_type_channel == message.identifier
+            # Twitch clock, the video-playback messages (viewcount) are the most frequent with a server_time
+            if received_at is not None and "server_time" in message.message:
+                ServerClock.observe(float(message.message["server_time"]), received_at)
+
+            handler = ws.parent_pool.handlers.get(message.topic, message.type)
+            if handler is None:
+                Metrics.counter("pubsub.messages.unhandled").inc()
+                return
+
+            # If we have more than one PubSub connection (or during a reconnection) messages may be duplicated
+            # Check the concatenation between message_type.topic.channel_id and the timestamp, on all the connections
+            if ws.parent_pool.deduplicator.is_duplicate(
+                message.identifier, message.timestamp
             ):
                 return
 
-            ws.last_message_timestamp = message.timestamp
-            ws.last_message_type_channel = message.identifier
-
-            streamer_index = get_streamer_index(ws.streamers, message.channel_id)
-            if streamer_index != -1:
-                try:
-                    if message.topic == "community-points-user-v1":
-                        if message.type in ["points-earned", "points-spent"]:
-                            balance = message.data["balance"]["balance"]
-                            ws.streamers[streamer_index].channel_points = balance
-                            # Analytics switch
-                            if Settings.enable_analytics is True:
-                                ws.streamers[streamer_index].persistent_series(
-                                    event_type=message.data["point_gain"]["reason_code"]
-                                    if message.type == "points-earned"
-                                    else "Spent"
-                                )
-
-                        if message.type == "points-earned":
-                            earned = message.data["point_gain"]["total_points"]
-                            reason_code = message.data["point_gain"]["reason_code"]
-
-                            logger.info(
-                                f"+{earned} → {ws.streamers[streamer_index]} - Reason: {reason_code}.",
-                                extra={
-                                    "emoji": ":rocket:",
-                                    "event": Events.get(f"GAIN_FOR_{reason_code}"),
-                                },
-                            )
-                            ws.streamers[streamer_index].update_history(
-                                reason_code, earned
-                            )
-                            # Analytics switch
-                            if Settings.enable_analytics is True:
-                                ws.streamers[streamer_index].persistent_annotations(
-                                    reason_code, f"+{earned} - {reason_code}"
-                                )
-                        elif message.type == "claim-available":
-                            ws.twitch.claim_bonus(
-                                ws.streamers[streamer_index],
-                                message.data["claim"]["id"],
-                            )
-
-                    elif message.topic == "video-playback-by-id":
-                        # There is stream-up message type, but it's sent earlier than the API updates
-                        if message.type == "stream-up":
-                            ws.streamers[streamer_index].stream_up = time.time()
-                        elif message.type == "stream-down":
-                            if ws.streamers[streamer_index].is_online is True:
-                                ws.streamers[streamer_index].set_offline()
-                        elif message.type == "viewcount":
-                            if ws.streamers[streamer_index].stream_up_elapsed():
-                                ws.twitch.check_streamer_online(
-                                    ws.streamers[streamer_index]
-                                )
-
-                    elif message.topic == "raid":
-                        if message.type == "raid_update_v2":
-                            raid = Raid(
-                                message.message["raid"]["id"],
-                                message.message["raid"]["target_login"],
-                            )
-                            ws.twitch.update_raid(ws.streamers[streamer_index], raid)
-
-                    elif message.topic == "community-moments-channel-v1":
-                        if message.type == "active":
-                            ws.twitch.claim_moment(
-                                ws.streamers[streamer_index], message.data["moment_id"]
-                            )
-
-                    elif message.topic == "predictions-channel-v1":
-
-                        event_dict = message.data["event"]
-                        event_id = event_dict["id"]
-                        event_status = event_dict["status"]
-
-                        current_tmsp = parser.parse(message.timestamp)
-
-                        if (
-                            message.type == "event-created"
-                            and event_id not in ws.events_predictions
-                        ):
-                            if event_status == "ACTIVE":
-                                prediction_window_seconds = float(
-                                    event_dict["prediction_window_seconds"]
-                                )
-                                # Reduce prediction window by 3/6s - Collect more accurate data for decision
-                                prediction_window_seconds = ws.streamers[
-                                    streamer_index
-                                ].get_prediction_window(prediction_window_seconds)
-                                event = EventPrediction(
-                                    ws.streamers[streamer_index],
-                                    event_id,
-                                    event_dict["title"],
-                                    parser.parse(event_dict["created_at"]),
-                                    prediction_window_seconds,
-                                    event_status,
-                                    event_dict["outcomes"],
-                                )
-                                if (
-                                    ws.streamers[streamer_index].is_online
-                                    and event.closing_bet_after(current_tmsp) > 0
-                                ):
-                                    streamer = ws.streamers[streamer_index]
-                                    bet_settings = streamer.settings.bet
-                                    if (
-                                        bet_settings.minimum_points is None
-                                        or streamer.channel_points
-                                        > bet_settings.minimum_points
-                                    ):
-                                        ws.events_predictions[event_id] = event
-                                        start_after = event.closing_bet_after(
-                                            current_tmsp
-                                        )
-
-                                        place_bet_thread = Timer(
-                                            start_after,
-                                            ws.twitch.make_predictions,
-                                            (ws.events_predictions[event_id],),
-                                        )
-                                        place_bet_thread.daemon = True
-                                        place_bet_thread.start()
-
-                                        logger.info(
-                                            f"Place the bet after: {start_after}s for: {ws.events_predictions[event_id]}",
-                                            extra={
-                                                "emoji": ":alarm_clock:",
-                                                "event": Events.BET_START,
-                                            },
-                                        )
-                                    else:
-                                        logger.info(
-                                            f"{streamer} have only {streamer.channel_points} channel points and the minimum for bet is: {bet_settings.minimum_points}",
-                                            extra={
-                                                "emoji": ":pushpin:",
-                                                "event": Events.BET_FILTERS,
-                                            },
-                                        )
-
-                        elif (
-                            message.type == "event-updated"
-                            and event_id in ws.events_predictions
-                        ):
-                            ws.events_predictions[event_id].status = event_status
-                            # Game over we can't update anymore the values... The bet was placed!
-                            if (
-                                ws.events_predictions[event_id].bet_placed is False
-                                and ws.events_predictions[event_id].bet.decision == {}
-                            ):
-                                ws.events_predictions[event_id].bet.update_outcomes(
-                                    event_dict["outcomes"]
-                                )
-
-                    elif message.topic == "predictions-user-v1":
-                        event_id = message.data["prediction"]["event_id"]
-                        if event_id in ws.events_predictions:
-                            event_prediction = ws.events_predictions[event_id]
-                            if (
-                                message.type == "prediction-result"
-                                and event_prediction.bet_confirmed
-                            ):
-                                points = event_prediction.parse_result(
-                                    message.data["prediction"]["result"]
-                                )
-
-                                decision = event_prediction.bet.get_decision()
-                                choice = event_prediction.bet.decision["choice"]
-
-                                logger.info(
-                                    (
-                                        f"{event_prediction} - Decision: {choice}: {decision['title']} "
-                                        f"({decision['color']}) - Result: {event_prediction.result['string']}"
-                                    ),
-                                    extra={
-                                        "emoji": ":bar_chart:",
-                                        "event": Events.get(
-                                            f"BET_{event_prediction.result['type']}"
-                                        ),
-                                    },
-                                )
-
-                                ws.streamers[streamer_index].update_history(
-                                    "PREDICTION", points["gained"]
-                                )
-
-                                # Remove duplicate history records from previous message sent in community-points-user-v1
-                                if event_prediction.result["type"] == "REFUND":
-                                    ws.streamers[streamer_index].update_history(
-                                        "REFUND",
-                                        -points["placed"],
-                                        counter=-1,
-                                    )
-                                elif event_prediction.result["type"] == "WIN":
-                                    ws.streamers[streamer_index].update_history(
-                                        "PREDICTION",
-                                        -points["won"],
-                                        counter=-1,
-                                    )
-
-                                if event_prediction.result["type"]:
-                                    # Analytics switch
-                                    if Settings.enable_analytics is True:
-                                        ws.streamers[
-                                            streamer_index
-                                        ].persistent_annotations(
-                                            event_prediction.result["type"],
-                                            f"{ws.events_predictions[event_id].title}",
-                                        )
-                            elif message.type == "prediction-made":
-                                event_prediction.bet_confirmed = True
-                                # Analytics switch
-                                if Settings.enable_analytics is True:
-                                    ws.streamers[streamer_index].persistent_annotations(
-                                        "PREDICTION_MADE",
-                                        f"Decision: {event_prediction.bet.decision['choice']} - {event_prediction.title}",
-                                    )
-                    elif message.topic == "community-points-channel-v1":
-                        if message.type == "community-goal-created":
-                            # TODO Untested, hard to find this happening live
-                            ws.streamers[streamer_index].add_community_goal(
-                                CommunityGoal.from_pubsub(message.data["community_goal"])
-                            )
-                        elif message.type == "community-goal-updated":
-                            ws.streamers[streamer_index].update_community_goal(
-                                CommunityGoal.from_pubsub(message.data["community_goal"])
-                            )
-                        elif message.type == "community-goal-deleted":
-                            # TODO Untested, not sure what the message format for this is,
-                            #      https://github.com/sammwyy/twitch-ps/blob/master/main.js#L417
-                            #      suggests that it should be just the entire, now deleted, goal model
-                            ws.streamers[streamer_index].delete_community_goal(message.data["community_goal"]["id"])
-
-                        if message.type in ["community-goal-updated", "community-goal-created"]:
-                            ws.twitch.contribute_to_community_goals(ws.streamers[streamer_index])
-
-                except Exception:
-                    logger.error(
-                        f"Exception raised for topic: {message.topic} and message: {message}",
-                        exc_info=True,
+            streamer = ws.parent_pool.get_streamer(message.channel_id)
+            if streamer is not None:
+                lane = (
+                    ws.parent_pool.fast_lane
+                    if handler.fast_lane is True
+                    else ws.parent_pool.workers
+                )
+                lane.submit(streamer.channel_id, handler, ws, streamer, message)
+
+        elif response["type"] == "RESPONSE":
+            request_type, topics, sent_at = ws.pending_nonces.pop(
+                response.get("nonce", ""), (None, [], None)
+            )
+            if sent_at is not None:
+                Metrics.histogram(f"pubsub.{request_type.lower()}.seconds").observe(
+                    time.time() - sent_at
+                )
+
+            error_message = response.get("error", "") or ""
+            if request_type == "UNLISTEN":
+                # The slot is free (or lost) anyway, forget the topics
+                for topic in topics:
+                    if ws.topics_state.get(str(topic)) == TopicState.UNSUBSCRIBING:
+                        del ws.topics_state[str(topic)]
+                if len(error_message) > 0:
+                    Metrics.counter("pubsub.unlisten.errors").inc()
+                    logger.warning(
+                        f"#{ws.index} - Error while trying to unlisten for {len(topics)} topics: {error_message}"
                     )
+                return
 
-        elif response["type"] == "RESPONSE" and len(response.get("error", "")) > 0:
+            if len(error_message) == 0:
+                for topic in topics:
+                    if ws.topics_state.get(str(topic)) == TopicState.SUBSCRIBING:
+                        ws.topics_state[str(topic)] = TopicState.ACTIVE
+                return
+
+            Metrics.counter("pubsub.listen.errors").inc()
+            if len(topics) > 1:
+                # Find out which topics of the batch are failing, retry them one by one
+                logger.warning(
+                    f"#{ws.index} - Error while trying to listen for {len(topics)} topics: {error_message}. Retry one by one"
+                )
+                for topic in topics:
+                    ws.listen(topic, ws.twitch.twitch_login.get_auth_token())
+                return
+
+            for topic in topics:
+                ws.topics_state[str(topic)] = TopicState.FAILED
             # raise RuntimeError(f"Error while trying to listen for a topic: {response}")
-            error_message = response.get("error", "")
-            logger.error(f"Error while trying to listen for a topic: {error_message}")
-            
+            logger.error(
+                f"Error while trying to listen for a topic: {error_message}"
+                + (f" ({topics[0]})" if topics != [] else "")
+            )
+
             # Check if the error message indicates an authentication issue (ERR_BADAUTH)
             if "ERR_BADAUTH" in error_message:
                 # Inform the user about the potential outdated cookie file
@@ -448,7 +622,7 @@ class WebSocketsPool:
 
         elif response["type"] == "RECONNECT":
             logger.info(f"#{ws.index} - Reconnection required")
-            WebSocketsPool.handle_reconnection(ws)
+            WebSocketsPool.handle_reconnection(ws, immediate=True)
 
         elif response["type"] == "PONG":
             ws.last_pong = time.time()
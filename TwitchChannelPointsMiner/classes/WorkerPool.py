@@ -0,0 +1,72 @@
+import logging
+import time
+from queue import Queue
+from threading import Thread
+from zlib import crc32
+
+from TwitchChannelPointsMiner.classes.Metrics import Metrics
+
+logger = logging.getLogger(__name__)
+
+
+class OrderedWorkerPool(object):
+    """
+    Bounded pool of worker threads. Each job has a key (usually a channel_id):
+    jobs with the same key always run on the same worker, in the order they were submitted.
+    """
+
+    __slots__ = ["name", "queues", "threads", "queue_depth", "wait_time"]
+
+    def __init__(
+        self,
+        name: str,
+        workers: int = 4,
+        max_queue: int = 1000,
+        prefix: str = "pubsub.workers",
+    ):
+        self.name = name
+        self.queues = [Queue(maxsize=max_queue) for _ in range(max(workers, 1))]
+        self.threads = []
+        self.queue_depth = Metrics.gauge(f"{prefix}.{name}.queue_depth")
+        self.wait_time = Metrics.histogram(f"{prefix}.{name}.wait.seconds")
+        for index in range(len(self.queues)):
+            thread = Thread(target=self.__run, args=(self.queues[index],))
+            thread.daemon = True
+            thread.name = f"{prefix}.{name} #{index}"
+            thread.start()
+            self.threads.append(thread)
+
+    def submit(self, key, callback, *args):
+        # Stable hash, the same key goes always on the same queue. Blocks if the queue is full
+        queue = self.queues[crc32(str(key).encode()) % len(self.queues)]
+        queue.put((time.time(), callback, args))
+        self.queue_depth.set(self.depth())
+
+    def depth(self) -> int:
+        return sum(queue.qsize() for queue in self.queues)
+
+    def join(self):
+        # Wait until all the submitted jobs are completed
+        for queue in self.queues:
+            queue.join()
+
+    def stop(self):
+        for queue in self.queues:
+            queue.put(None)
+
+    def __run(self, queue):
+        while True:
+            item = queue.get()
+            try:
+                if item is None:
+                    break
+                submitted_at, callback, args = item
+                self.wait_time.observe(time.time() - submitted_at)
+                self.queue_depth.set(self.depth())
+                callback(*args)
+            except Exception:
+                logger.error(
+                    f"Exception raised in {self.name} worker", exc_info=True
+                )
+            finally:
+                queue.task_done()
@@ -1,10 +1,12 @@
-import copy
+import time
 from enum import Enum, auto
 from random import uniform
+from threading import Lock
 
 from millify import millify
 
 #from TwitchChannelPointsMiner.utils import char_decision_as_index, float_round
+from TwitchChannelPointsMiner.classes.Metrics import Metrics
 from TwitchChannelPointsMiner.utils import float_round
 
 
@@ -87,6 +89,7 @@ class BetSettings(object):
         "filter_condition",
         "delay",
         "delay_mode",
+        "refresh_timeout",
     ]
 
     def __init__(
@@ -100,6 +103,7 @@ class BetSettings(object):
         filter_condition: FilterCondition = None,
         delay: float = None,
         delay_mode: DelayMode = None,
+        refresh_timeout: float = None,
     ):
         self.strategy = strategy
         self.percentage = percentage
@@ -110,6 +114,7 @@ class BetSettings(object):
         self.filter_condition = filter_condition
         self.delay = delay
         self.delay_mode = delay_mode
+        self.refresh_timeout = refresh_timeout
 
     def default(self):
         self.strategy = self.strategy if self.strategy is not None else Strategy.SMART
@@ -128,92 +133,170 @@ class BetSettings(object):
         self.delay_mode = (
             self.delay_mode if self.delay_mode is not None else DelayMode.FROM_END
         )
+        self.refresh_timeout = (
+            self.refresh_timeout if self.refresh_timeout is not None else 0
+        )
 
     def __repr__(self):
         return f"BetSettings(strategy={self.strategy}, percentage={self.percentage}, percentage_gap={self.percentage_gap}, max_points={self.max_points}, minimum_points={self.minimum_points}, stealth_mode={self.stealth_mode})"
 
 
+class Outcome(object):
+    # Compact record of an outcome, still readable as a dict: outcome[OutcomeKeys.ODDS], outcome["title"]
+    __slots__ = [
+        "id",
+        "title",
+        "color",
+        "total_users",
+        "total_points",
+        "top_points",
+        "percentage_users",
+        "odds",
+        "odds_percentage",
+    ]
+
+    def __init__(self, outcome: dict):
+        self.id = outcome["id"]
+        self.title = outcome["title"]
+        self.color = outcome["color"]
+        self.total_users = int(outcome.get(OutcomeKeys.TOTAL_USERS, 0))
+        self.total_points = int(outcome.get(OutcomeKeys.TOTAL_POINTS, 0))
+        # Saved outcomes (BetScheduler) have top_points, PubSub ones have top_predictors
+        self.top_points = outcome.get(OutcomeKeys.TOP_POINTS, 0)
+        for predictor in outcome.get("top_predictors", []):
+            if predictor["points"] > self.top_points:
+                self.top_points = predictor["points"]
+        # Derived by Bet only when a decision is needed
+        self.percentage_users = 0
+        self.odds = 0
+        self.odds_percentage = 0
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        setattr(self, key, value)
+
+    def __repr__(self):
+        return f"Outcome({self.to_dict()})"
+
+    def to_dict(self):
+        return {key: getattr(self, key) for key in Outcome.__slots__}
+
+
 class Bet(object):
-    __slots__ = ["outcomes", "decision", "total_users", "total_points", "settings"]
+    __slots__ = [
+        "outcomes",
+        "decision",
+        "total_users",
+        "total_points",
+        "settings",
+        "derived",
+        "snapshot",
+        "updated_at",
+        "lock",
+    ]
 
     def __init__(self, outcomes: list, settings: BetSettings):
-        self.outcomes = outcomes
-        self.__clear_outcomes()
+        self.outcomes = [Outcome(outcome) for outcome in outcomes]
         self.decision: dict = {}
         self.total_users = 0
         self.total_points = 0
         self.settings = settings
+        # The odds and percentages are up to date
+        self.derived = True
+        # Latest raw outcomes received, not parsed yet
+        self.snapshot = None
+        # Epoch of the latest outcomes, PubSub or GQL
+        self.updated_at = time.time()
+        # The snapshot is handed from the PubSub worker to the bet worker
+        self.lock = Lock()
+
+    def set_snapshot(self, outcomes, updated_at=None):
+        # Only the outcomes at bet time matter, the previous snapshot is just overwritten
+        with self.lock:
+            self.snapshot = outcomes
+            self.updated_at = time.time() if updated_at is None else updated_at
+        Metrics.counter("bets.updates.received").inc()
+
+    def staleness(self):
+        return time.time() - self.updated_at
+
+    def refresh(self):
+        # Parse the latest snapshot, once
+        with self.lock:
+            snapshot, self.snapshot = self.snapshot, None
+        if snapshot is not None:
+            self.update_outcomes(snapshot)
+            Metrics.counter("bets.updates.processed").inc()
+        self.__derive()
 
     def update_outcomes(self, outcomes):
-        for index in range(0, len(self.outcomes)):
-            self.outcomes[index][OutcomeKeys.TOTAL_USERS] = int(
-                outcomes[index][OutcomeKeys.TOTAL_USERS]
-            )
-            self.outcomes[index][OutcomeKeys.TOTAL_POINTS] = int(
-                outcomes[index][OutcomeKeys.TOTAL_POINTS]
-            )
-            if outcomes[index]["top_predictors"] != []:
-                # Sort by points placed by other users
-                outcomes[index]["top_predictors"] = sorted(
-                    outcomes[index]["top_predictors"],
-                    key=lambda x: x["points"],
-                    reverse=True,
-                )
-                # Get the first elements (most placed)
-                top_points = outcomes[index]["top_predictors"][0]["points"]
-                self.outcomes[index][OutcomeKeys.TOP_POINTS] = top_points
-            else:
-                # Ensure TOP_POINTS is set to 0 if no top predictors
-                self.outcomes[index][OutcomeKeys.TOP_POINTS] = 0
-
-        # Calculate totals
-        self.total_points = 0
-        self.total_users = 0
-        for index in range(0, len(self.outcomes)):
-            self.total_users += self.outcomes[index][OutcomeKeys.TOTAL_USERS]
-            self.total_points += self.outcomes[index][OutcomeKeys.TOTAL_POINTS]
+        # Called for each event-updated message: one pass, nothing allocated, the odds are derived later
+        total_users = 0
+        total_points = 0
+        for outcome, data in zip(self.outcomes, outcomes):
+            outcome.total_users = int(data[OutcomeKeys.TOTAL_USERS])
+            outcome.total_points = int(data[OutcomeKeys.TOTAL_POINTS])
+            # Most points placed by a single user
+            top_points = 0
+            for predictor in data["top_predictors"]:
+                if predictor["points"] > top_points:
+                    top_points = predictor["points"]
+            outcome.top_points = top_points
+            total_users += outcome.total_users
+            total_points += outcome.total_points
+
+        self.total_users = total_users
+        self.total_points = total_points
+        self.derived = False
+
+    def __derive(self):
+        if self.derived is True:
+            return
+        self.derived = True
 
         # Only calculate percentages and odds if we have meaningful data
         if self.total_users > 0 and self.total_points > 0:
-            for index in range(0, len(self.outcomes)):
+            for outcome in self.outcomes:
                 # User percentage calculation
-                self.outcomes[index][OutcomeKeys.PERCENTAGE_USERS] = float_round(
-                    (100 * self.outcomes[index][OutcomeKeys.TOTAL_USERS]) / self.total_users
+                outcome.percentage_users = float_round(
+                    (100 * outcome.total_users) / self.total_users
                 )
-                
+
                 # Improved odds calculation with safety checks
-                outcome_points = self.outcomes[index][OutcomeKeys.TOTAL_POINTS]
-                if outcome_points > 0:
-                    raw_odds = self.total_points / outcome_points
+                if outcome.total_points > 0:
+                    raw_odds = self.total_points / outcome.total_points
                     # Cap extremely high odds to prevent overflow and unrealistic scenarios
-                    self.outcomes[index][OutcomeKeys.ODDS] = float_round(min(raw_odds, 1000))
+                    outcome.odds = float_round(min(raw_odds, 1000))
                 else:
                     # If no points on this outcome, set very high odds (but not infinite)
-                    self.outcomes[index][OutcomeKeys.ODDS] = 999
-                
+                    outcome.odds = 999
+
                 # Odds percentage calculation with safety
-                odds_value = self.outcomes[index][OutcomeKeys.ODDS]
-                if odds_value > 0:
-                    odds_percentage = 100 / odds_value
+                if outcome.odds > 0:
+                    odds_percentage = 100 / outcome.odds
                     # Ensure odds percentage is reasonable (between 0.1% and 100%)
-                    self.outcomes[index][OutcomeKeys.ODDS_PERCENTAGE] = float_round(
+                    outcome.odds_percentage = float_round(
                         max(0.1, min(odds_percentage, 100))
                     )
                 else:
-                    self.outcomes[index][OutcomeKeys.ODDS_PERCENTAGE] = 0.1
+                    outcome.odds_percentage = 0.1
         else:
             # If insufficient data, set default safe values
-            for index in range(0, len(self.outcomes)):
-                self.outcomes[index][OutcomeKeys.PERCENTAGE_USERS] = 50.0 if len(self.outcomes) == 2 else 100.0 / len(self.outcomes)
-                self.outcomes[index][OutcomeKeys.ODDS] = 2.0 if len(self.outcomes) == 2 else len(self.outcomes)
-                self.outcomes[index][OutcomeKeys.ODDS_PERCENTAGE] = 50.0 if len(self.outcomes) == 2 else 100.0 / len(self.outcomes)
-
-        self.__clear_outcomes()
+            for outcome in self.outcomes:
+                outcome.percentage_users = 50.0 if len(self.outcomes) == 2 else 100.0 / len(self.outcomes)
+                outcome.odds = 2.0 if len(self.outcomes) == 2 else len(self.outcomes)
+                outcome.odds_percentage = 50.0 if len(self.outcomes) == 2 else 100.0 / len(self.outcomes)
 
     def __repr__(self):
         return f"Bet(total_users={millify(self.total_users)}, total_points={millify(self.total_points)}), decision={self.decision})\n\t\tOutcome A({self.get_outcome(0)})\n\t\tOutcome B({self.get_outcome(1)})"
 
     def get_decision(self, parsed=False):
+        self.__derive()
         #decision = self.outcomes[0 if self.decision["choice"] == "A" else 1]
         decision = self.outcomes[self.decision["choice"]]
         return decision if parsed is False else Bet.__parse_outcome(decision)
@@ -223,33 +306,9 @@ class Bet(object):
         return f"{outcome['title']} ({outcome['color']}), Points: {millify(outcome[OutcomeKeys.TOTAL_POINTS])}, Users: {millify(outcome[OutcomeKeys.TOTAL_USERS])} ({outcome[OutcomeKeys.PERCENTAGE_USERS]}%), Odds: {outcome[OutcomeKeys.ODDS]} ({outcome[OutcomeKeys.ODDS_PERCENTAGE]}%)"
 
     def get_outcome(self, index):
+        self.__derive()
         return Bet.__parse_outcome(self.outcomes[index])
 
-    def __clear_outcomes(self):
-        for index in range(0, len(self.outcomes)):
-            keys = copy.deepcopy(list(self.outcomes[index].keys()))
-            for key in keys:
-                if key not in [
-                    OutcomeKeys.TOTAL_USERS,
-                    OutcomeKeys.TOTAL_POINTS,
-                    OutcomeKeys.TOP_POINTS,
-                    OutcomeKeys.PERCENTAGE_USERS,
-                    OutcomeKeys.ODDS,
-                    OutcomeKeys.ODDS_PERCENTAGE,
-                    "title",
-                    "color",
-                    "id",
-                ]:
-                    del self.outcomes[index][key]
-            for key in [
-                OutcomeKeys.PERCENTAGE_USERS,
-                OutcomeKeys.ODDS,
-                OutcomeKeys.ODDS_PERCENTAGE,
-                OutcomeKeys.TOP_POINTS,
-            ]:
-                if key not in self.outcomes[index]:
-                    self.outcomes[index][key] = 0
-
     '''def __return_choice(self, key) -> str:
         return "A" if self.outcomes[0][key] > self.outcomes[1][key] else "B"'''
 
@@ -433,6 +492,7 @@ class Bet(object):
         return True
 
     def skip(self) -> bool:
+        self.__derive()
         if self.settings.filter_condition is not None:
             # key == by , condition == where
             key = self.settings.filter_condition.by
@@ -472,6 +532,7 @@ class Bet(object):
 
     def calculate(self, balance: int) -> dict:
         self.decision = {"choice": None, "amount": 0, "id": None}
+        self.refresh()
         
         # Early exit if no valid outcomes or insufficient data
         if len(self.outcomes) < 2 or self.total_users < 10:
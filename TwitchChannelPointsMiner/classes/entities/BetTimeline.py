@@ -0,0 +1,110 @@
+import logging
+import time
+
+from TwitchChannelPointsMiner.classes.Metrics import Metrics
+from TwitchChannelPointsMiner.classes.ServerClock import ServerClock
+
+logger = logging.getLogger(__name__)
+
+
+class BetTimeline(object):
+    """
+    Timestamps of each stage of a bet, on the Twitch clock, compared with the real close time of the prediction.
+    Each stage feeds the histogram bets.deadline.{stage}.seconds: the seconds left before the close, negative when late.
+    """
+
+    __slots__ = ["closes_at", "marks"]
+
+    # In order: event-created received, prepare due (a planned wait), outcomes refreshed (optional), request prepared,
+    # bet due (a planned wait), scheduler fired, decision computed, MakePrediction sent, response received,
+    # prediction-made received
+    STAGES = [
+        "created",
+        "prepare_due",
+        "refreshed",
+        "prepared",
+        "due",
+        "fired",
+        "decided",
+        "sent",
+        "response",
+        "confirmed",
+    ]
+    # Wanted, not slow
+    WAITS = ["prepare_due", "due"]
+    # Seconds left before the close
+    BUCKETS = [-5, -1, 0, 0.5, 1, 2, 3, 5, 10, 30, 60, 300]
+    # MakePrediction errors of a bet that arrived after the close. Not taken from real responses: only a hint,
+    # a failure is classified by its timestamps and by the prediction status. Each code is counted in bets.failed.{code}
+    CLOSED_ERRORS = ["EVENT_NOT_ACTIVE", "EVENT_LOCKED", "PREDICTION_WINDOW_CLOSED"]
+
+    def __init__(self, closes_at=None):
+        # Epoch on the Twitch clock: created_at + prediction_window_seconds (not reduced by the delay settings)
+        self.closes_at = closes_at
+        # stage -> epoch on the Twitch clock
+        self.marks = {}
+
+    def mark(self, stage, local_time=None):
+        # local_time: when it really happened (e.g. the message received time), now by default
+        timestamp = (time.time() if local_time is None else local_time) + ServerClock.offset
+        self.marks[stage] = timestamp
+        if self.closes_at is not None:
+            Metrics.histogram(
+                f"bets.deadline.{stage}.seconds", buckets=BetTimeline.BUCKETS
+            ).observe(self.closes_at - timestamp)
+
+    def left(self, stage):
+        # Seconds left before the close at the given stage
+        if self.closes_at is None or stage not in self.marks:
+            return None
+        return round(self.closes_at - self.marks[stage], 3)
+
+    def durations(self) -> dict:
+        # Seconds spent to reach each stage from the previous one
+        durations = {}
+        previous = None
+        for stage in BetTimeline.STAGES:
+            if stage not in self.marks:
+                continue
+            if previous is not None:
+                durations[stage] = round(self.marks[stage] - self.marks[previous], 3)
+            previous = stage
+        return durations
+
+    def slowest(self):
+        durations = self.durations()
+        for stage in BetTimeline.WAITS:
+            durations.pop(stage, None)
+        return max(durations, key=durations.get) if durations != {} else None
+
+    def arrived_late(self):
+        # The request reached Twitch, on average, halfway between sent and response
+        if self.closes_at is None or "sent" not in self.marks:
+            return None
+        arrived_at = (self.marks["sent"] + self.marks.get("response", self.marks["sent"])) / 2
+        return arrived_at >= self.closes_at
+
+    def failed(self, error_code, status=None) -> bool:
+        # Blame the slowest stage of a bet refused because the prediction was closed
+        Metrics.counter(f"bets.failed.{error_code}").inc()
+        if not (
+            self.arrived_late() is True
+            or (status is not None and status != "ACTIVE")
+            or error_code in BetTimeline.CLOSED_ERRORS
+        ):
+            return False
+        stage = self.slowest()
+        if stage is not None:
+            Metrics.counter(f"bets.late.{stage}").inc()
+        logger.warning(f"Bet after the close, slowest stage: {stage} - {self}")
+        return True
+
+    def __repr__(self):
+        durations = self.durations()
+        return ", ".join(
+            stage
+            + (f" {self.left(stage)}s left" if self.closes_at is not None else "")
+            + (f" (+{durations[stage]}s)" if stage in durations else "")
+            for stage in BetTimeline.STAGES
+            if stage in self.marks
+        )
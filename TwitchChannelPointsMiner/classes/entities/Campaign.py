@@ -22,11 +22,20 @@ class Campaign(object):
         "start_at",
         "dt_match",
         "drops",
+        "known_drops",
         "channels",
     ]
 
     def __init__(self, dict):
         self.id = dict["id"]
+        self.in_inventory = False
+        # drop id -> Drop, also the ones removed by clear_drops: a drop keeps its progress across the syncs
+        self.known_drops = {}
+
+        self.update_details(dict)
+
+    def update_details(self, dict):
+        # Kept across the syncs and updated in place, also to check again the dates
         self.game = dict["game"]
         self.name = dict["name"]
         self.status = dict["status"]
@@ -35,13 +44,19 @@ class Campaign(object):
             if dict["allow"]["channels"] is None
             else list(map(lambda x: x["id"], dict["allow"]["channels"]))
         )
-        self.in_inventory = False
 
         self.end_at = parse_datetime(dict["endAt"])
         self.start_at = parse_datetime(dict["startAt"])
         self.dt_match = self.start_at < datetime.now() < self.end_at
 
-        self.drops = list(map(lambda x: Drop(x), dict["timeBasedDrops"]))
+        self.drops = []
+        for drop_dict in dict["timeBasedDrops"]:
+            drop = self.known_drops.get(drop_dict["id"], None)
+            if drop is None:
+                drop = self.known_drops[drop_dict["id"]] = Drop(drop_dict)
+            else:
+                drop.update_details(drop_dict)
+            self.drops.append(drop)
 
     def __repr__(self):
         return f"Campaign(id={self.id}, name={self.name}, game={self.game}, in_inventory={self.in_inventory})"
@@ -31,11 +31,6 @@ class Drop(object):
 
     def __init__(self, dict):
         self.id = dict["id"]
-        self.name = dict["name"]
-        self.benefit = ", ".join(
-            list(set([bf["benefit"]["name"] for bf in dict["benefitEdges"]]))
-        )
-        self.minutes_required = dict["requiredMinutesWatched"]
 
         self.has_preconditions_met = None  # [True, False], None we don't know
         self.current_minutes_watched = 0
@@ -45,6 +40,16 @@ class Drop(object):
         self.is_printable = False
         self.percentage_progress = 0
 
+        self.update_details(dict)
+
+    def update_details(self, dict):
+        # From DropCampaignDetails, the progress is kept
+        self.name = dict["name"]
+        self.benefit = ", ".join(
+            list(set([bf["benefit"]["name"] for bf in dict["benefitEdges"]]))
+        )
+        self.minutes_required = dict["requiredMinutesWatched"]
+
         self.end_at = parse_datetime(dict["endAt"])
         self.start_at = parse_datetime(dict["startAt"])
         self.dt_match = self.start_at < datetime.now() < self.end_at
@@ -1,9 +1,31 @@
+import time
+from enum import Enum, auto
+
 from TwitchChannelPointsMiner.classes.entities.Bet import Bet
+from TwitchChannelPointsMiner.classes.entities.BetTimeline import BetTimeline
 from TwitchChannelPointsMiner.classes.entities.Streamer import Streamer
 from TwitchChannelPointsMiner.classes.Settings import Settings
 from TwitchChannelPointsMiner.utils import _millify, float_round
 
 
+class PredictionState(Enum):
+    CREATED = auto()
+    LOCKED = auto()
+    RESOLVED = auto()
+
+    @staticmethod
+    def from_status(status):
+        # Twitch status: ACTIVE, LOCKED, RESOLVE_PENDING, CANCEL_PENDING, RESOLVED, CANCELED
+        if status == "ACTIVE":
+            return PredictionState.CREATED
+        if status in ["RESOLVED", "CANCELED"]:
+            return PredictionState.RESOLVED
+        return PredictionState.LOCKED
+
+    def __str__(self):
+        return self.name
+
+
 class EventPrediction(object):
     __slots__ = [
         "streamer",
@@ -12,11 +34,15 @@ class EventPrediction(object):
         "created_at",
         "prediction_window_seconds",
         "status",
+        "state",
+        "resolved_at",
         "result",
         "box_fillable",
         "bet_confirmed",
         "bet_placed",
         "bet",
+        "timeline",
+        "request",
     ]
 
     def __init__(
@@ -36,12 +62,18 @@ class EventPrediction(object):
         self.created_at = created_at
         self.prediction_window_seconds = prediction_window_seconds
         self.status = status
+        self.state = PredictionState.from_status(status)
+        # Epoch, when the state became RESOLVED
+        self.resolved_at = None if self.state != PredictionState.RESOLVED else time.time()
         self.result: dict = {"string": "", "type": None, "gained": 0}
 
         self.box_fillable = False
         self.bet_confirmed = False
         self.bet_placed = False
         self.bet = Bet(outcomes, streamer.settings.bet)
+        self.timeline = BetTimeline()
+        # (MakePrediction body, headers) built before the deadline by Twitch.prepare_prediction
+        self.request = None
 
     def __repr__(self):
         return f"EventPrediction(event_id={self.event_id}, streamer={self.streamer}, title={self.title})"
@@ -53,6 +85,20 @@ class EventPrediction(object):
             else self.__repr__()
         )
 
+    def set_status(self, status):
+        # Return the previous status. The state only moves forward: CREATED -> LOCKED -> RESOLVED
+        previous_status = self.status
+        state = PredictionState.from_status(status)
+        if state.value < self.state.value:
+            # A late message
+            return previous_status
+        self.status = status
+        if state != self.state:
+            self.state = state
+            if state == PredictionState.RESOLVED:
+                self.resolved_at = time.time()
+        return previous_status
+
     def elapsed(self, timestamp):
         return float_round((timestamp - self.created_at).total_seconds())
 
@@ -13,20 +13,24 @@ class Message(object):
         "timestamp",
         "channel_id",
         "identifier",
+        "received_at",
     ]
 
     def __init__(self, data):
-        self.topic, self.topic_user = data["topic"].split(".")
+        self.topic, _, self.topic_user = data["topic"].partition(".")
 
+        # The envelope is already decoded by the caller, decode the payload once
         self.message = json.loads(data["message"])
         self.type = self.message["type"]
 
-        self.data = self.message["data"] if "data" in self.message else None
+        self.data = self.message.get("data", None)
 
         self.timestamp = self.__get_timestamp()
         self.channel_id = self.__get_channel_id()
 
         self.identifier = f"{self.type}.{self.topic}.{self.channel_id}"
+        # Epoch (local clock) of the frame, set by the WebSocket
+        self.received_at = None
 
     def __repr__(self):
         return f"{self.message}"
@@ -35,35 +39,21 @@ class Message(object):
         return f"{self.message}"
 
     def __get_timestamp(self):
-        return (
-            server_time(self.message)
-            if self.data is None
-            else (
-                self.data["timestamp"]
-                if "timestamp" in self.data
-                else server_time(self.data)
-            )
-        )
+        if self.data is None:
+            return server_time(self.message)
+        timestamp = self.data.get("timestamp", None)
+        return server_time(self.data) if timestamp is None else timestamp
 
     def __get_channel_id(self):
-        return (
-            self.topic_user
-            if self.data is None
-            else (
-                self.data["prediction"]["channel_id"]
-                if "prediction" in self.data
-                else (
-                    self.data["claim"]["channel_id"]
-                    if "claim" in self.data
-                    else (
-                        self.data["channel_id"]
-                        if "channel_id" in self.data
-                        else (
-                            self.data["balance"]["channel_id"]
-                            if "balance" in self.data
-                            else self.topic_user
-                        )
-                    )
-                )
-            )
-        )
+        data = self.data
+        if data is None:
+            return self.topic_user
+        if "prediction" in data:
+            return data["prediction"]["channel_id"]
+        if "claim" in data:
+            return data["claim"]["channel_id"]
+        if "channel_id" in data:
+            return data["channel_id"]
+        if "balance" in data:
+            return data["balance"]["channel_id"]
+        return self.topic_user
@@ -1,3 +1,21 @@
+from enum import Enum, auto
+
+
+class TopicState(Enum):
+    # Submitted, the connection is not open yet
+    PENDING = auto()
+    # LISTEN sent, waiting for the RESPONSE
+    SUBSCRIBING = auto()
+    ACTIVE = auto()
+    # UNLISTEN sent, waiting for the RESPONSE
+    UNSUBSCRIBING = auto()
+    # LISTEN refused by the server
+    FAILED = auto()
+
+    def __str__(self):
+        return self.name
+
+
 class PubsubTopic(object):
     __slots__ = ["topic", "user_id", "streamer"]
 
@@ -14,3 +32,13 @@ class PubsubTopic(object):
             return f"{self.topic}.{self.user_id}"
         else:
             return f"{self.topic}.{self.streamer.channel_id}"
+
+    def owner(self):
+        # All the topics of a streamer share the same owner (the channel_id), the user topics have None
+        return None if self.is_user_topic() else str(self.streamer.channel_id)
+
+    def __eq__(self, other):
+        return isinstance(other, PubsubTopic) and str(self) == str(other)
+
+    def __hash__(self):
+        return hash(str(self))
@@ -1,10 +1,13 @@
+import os
+
 # Twitch endpoints
 URL = "https://www.twitch.tv"               # Browser, Apps
 # URL = "https://m.twitch.tv"               # Mobile Browser
 # URL = "https://android.tv.twitch.tv"      # TV
 IRC = "irc.chat.twitch.tv"
 IRC_PORT = 6667
-WEBSOCKET = "wss://pubsub-edge.twitch.tv/v1"
+# Can be overridden with the TWITCH_PUBSUB_URL environment variable, e.g. a local pubsub_server.py
+WEBSOCKET = os.environ.get("TWITCH_PUBSUB_URL", "wss://pubsub-edge.twitch.tv/v1")
 CLIENT_ID = "ue6666qo983tsx6so1t0vnawi233wa"        # TV
 # CLIENT_ID = "kimne78kx3ncx6brgo4mv6wki5h1ko"      # Browser
 # CLIENT_ID = "r8s4dac0uhzifbpu9sjdiwzctle17ff"     # Mobile Browser
@@ -132,6 +135,16 @@ class GQLOperations:
             }
         },
     }
+    ChannelPointsPredictionContext = {
+        "operationName": "ChannelPointsPredictionContext",
+        "variables": {"count": 1},
+        "extensions": {
+            "persistedQuery": {
+                "version": 1,
+                "sha256Hash": "beb846598256b75bd7c1fe54a80431335996153e358ca9c7837ce7bb83d7d383",
+            }
+        },
+    }
     MakePrediction = {
         "operationName": "MakePrediction",
         "extensions": {
@@ -27,6 +27,11 @@ twitch_miner = TwitchChannelPointsMiner(
     enable_analytics=False,                     # Disables Analytics if False. Disabling it significantly reduces memory consumption
     disable_ssl_cert_verification=False,        # Set to True at your own risk and only to fix SSL: CERTIFICATE_VERIFY_FAILED error
     disable_at_in_nickname=False,               # Set to True if you want to check for your nickname mentions in the chat even without @ sign
+    startup_profile_file=None,                  # Set a path (e.g. "startup.prof") to dump a cProfile of the startup phase. A per-phase timing report is always logged
+    pubsub_record_file=None,                    # Set a path (e.g. "pubsub.jsonl.gz") to record all the PubSub frames. Replay them offline with pubsub_replay.py
+    prediction_record_path=None,                # Set a folder (e.g. "predictions") to record the outcomes and the result of each prediction. Backtest the strategies with prediction_backtest.py
+    shadow_strategies=False,                    # Evaluate all the strategies on each prediction without betting, the profit of each one is in the final report
+    predictions_archive_file=None,              # Set a path (e.g. "predictions/archive.jsonl") to keep the resolved predictions removed from memory (after 1h, or beyond 200). The final report lists only the recent ones, the older are summed per streamer
     logger_settings=LoggerSettings(
         save=True,                              # If you want to save logs in a file (suggested)
         console_level=logging.INFO,             # Level of logs - use logging.DEBUG for more info
@@ -97,6 +102,7 @@ twitch_miner = TwitchChannelPointsMiner(
             stealth_mode=True,                  # If the calculated amount of channel points is GT the highest bet, place the highest value minus 1-2 points Issue #33
             delay_mode=DelayMode.FROM_END,      # When placing a bet, we will wait until `delay` seconds before the end of the timer
             delay=6,
+            refresh_timeout=1,                  # Fetch the latest outcomes just before the bet, wait at most 1s (0 disables)
             minimum_points=20000,               # Place the bet only if we have at least 20k points. Issue #113
             filter_condition=FilterCondition(
                 by=OutcomeKeys.TOTAL_USERS,     # Where apply the filter. Allowed [PERCENTAGE_USERS, ODDS_PERCENTAGE, ODDS, TOP_POINTS, TOTAL_USERS, TOTAL_POINTS]
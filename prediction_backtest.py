@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+
+# Backtest the bet strategies over the predictions recorded with prediction_record_path.
+# The decision logic of Bet.calculate and Bet.skip is vectorized with NumPy: a Strategy/BetSettings
+# combination is evaluated on all the predictions at once, thousands of combinations run in seconds.
+#
+# python prediction_backtest.py predictions/username
+# python prediction_backtest.py predictions/username --percentage 1 5 10 --max-points 1000 50000 \
+#     --filter total_users,GT,100 odds,LT,3 --top 20
+#
+# The outcomes are the ones recorded at decision time, the delay settings can't be backtested.
+# The random stealth_mode reduction is replaced by its average (5% of the top bet, at least 5.5 points).
+
+import argparse
+import itertools
+import time
+
+import numpy as np
+
+from TwitchChannelPointsMiner.classes.entities.Bet import (
+    Condition,
+    FilterCondition,
+    OutcomeKeys,
+    Strategy,
+)
+from TwitchChannelPointsMiner.classes.PredictionRecorder import PredictionRecorder
+from TwitchChannelPointsMiner.classes.VectorizedBet import (
+    Predictions,
+    calculate_amount,
+    calculate_choice,
+    skip,
+)
+
+
+def backtest(
+    predictions,
+    strategies,
+    percentage_gaps,
+    percentages,
+    max_points,
+    stealth_modes,
+    filter_conditions,
+):
+    results = []
+    grid = list(itertools.product(percentages, max_points, stealth_modes))
+    percentage = np.array([item[0] for item in grid], dtype=np.float64)
+    maximum = np.array([item[1] for item in grid], dtype=np.float64)
+    stealth = np.array([item[2] for item in grid], dtype=bool)
+
+    for strategy in strategies:
+        # The gap is used only by SMART
+        for percentage_gap in percentage_gaps if strategy == Strategy.SMART else [None]:
+            choice = calculate_choice(predictions, strategy, percentage_gap or 20)
+            amount = calculate_amount(predictions, choice, percentage, maximum, stealth)
+            gained = predictions.gained(choice, amount)
+            won = (choice == predictions.winner) & (choice >= 0)
+            for filter_condition in filter_conditions:
+                placed = (
+                    (choice >= 0)[None, :]
+                    & ~skip(predictions, choice, filter_condition)[None, :]
+                    & (amount >= 10)
+                )
+                bets = placed.sum(axis=1)
+                wins = (placed & won[None, :]).sum(axis=1)
+                total_gained = np.where(placed, gained, 0).sum(axis=1)
+                total_placed = np.where(placed, amount, 0).sum(axis=1)
+                for index, (item_percentage, item_max_points, item_stealth) in enumerate(grid):
+                    results.append(
+                        {
+                            "strategy": strategy,
+                            "percentage_gap": percentage_gap,
+                            "percentage": item_percentage,
+                            "max_points": item_max_points,
+                            "stealth_mode": item_stealth,
+                            "filter_condition": filter_condition,
+                            "bets": int(bets[index]),
+                            "wins": int(wins[index]),
+                            "placed": int(total_placed[index]),
+                            "gained": int(total_gained[index]),
+                        }
+                    )
+    return sorted(results, key=lambda result: result["gained"], reverse=True)
+
+
+def parse_filter(value):
+    # by,where,value e.g. total_users,GT,100
+    by, where, threshold = value.split(",")
+    return FilterCondition(
+        by=getattr(OutcomeKeys, by.upper()),
+        where=Condition[where.upper()],
+        value=float(threshold),
+    )
+
+
+def report(predictions, results, elapsed, top):
+    print(
+        f"Predictions: {predictions.size}, combinations: {len(results)}, "
+        f"{round(elapsed, 3)}s ({round(len(results) / max(elapsed, 1e-9))} combinations/s)"
+    )
+    print(f"Recorded bets gained: {int(predictions.recorded_gained.sum())}")
+    for result in results[:top]:
+        win_rate = round(100 * result["wins"] / result["bets"], 1) if result["bets"] > 0 else 0
+        roi = round(100 * result["gained"] / result["placed"], 1) if result["placed"] > 0 else 0
+        print(
+            f"  {result['strategy']}"
+            + (f" gap={result['percentage_gap']}" if result["percentage_gap"] is not None else "")
+            + f" percentage={result['percentage']} max_points={result['max_points']}"
+            + f" stealth={result['stealth_mode']} filter={result['filter_condition']}"
+            + f" -> bets={result['bets']} win={win_rate}% gained={result['gained']} roi={roi}%"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Backtest the bet strategies")
+    parser.add_argument("paths", nargs="+", help="Recorded folders or npz chunks")
+    parser.add_argument(
+        "--strategy",
+        nargs="+",
+        default=[strategy.name for strategy in Strategy],
+        help="Strategies to test, all by default",
+    )
+    parser.add_argument(
+        "--percentage-gap", nargs="+", type=float, default=list(range(5, 55, 5))
+    )
+    parser.add_argument(
+        "--percentage", nargs="+", type=float, default=[1, 2, 3, 5, 7, 10, 15, 20]
+    )
+    parser.add_argument(
+        "--max-points", nargs="+", type=int, default=[1000, 5000, 10000, 50000, 250000]
+    )
+    parser.add_argument(
+        "--filter",
+        nargs="*",
+        default=[],
+        help="Filter conditions as by,where,value e.g. total_users,GT,100. No filter is always tested",
+    )
+    parser.add_argument("--top", type=int, default=20)
+    args = parser.parse_args()
+
+    predictions = Predictions(PredictionRecorder.load(args.paths))
+    start = time.perf_counter()
+    results = backtest(
+        predictions,
+        strategies=[Strategy[name.upper()] for name in args.strategy],
+        percentage_gaps=args.percentage_gap,
+        percentages=args.percentage,
+        max_points=args.max_points,
+        stealth_modes=[False, True],
+        filter_conditions=[None] + [parse_filter(value) for value in args.filter],
+    )
+    report(predictions, results, time.perf_counter() - start, args.top)
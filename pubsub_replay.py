@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+
+# Replay the PubSub frames recorded with pubsub_record_file through WebSocketsPool.on_message.
+# Twitch is stubbed: nothing is sent, the calls are only counted.
+# Report the throughput and the latency of each handler, useful to benchmark the dispatch.
+#
+# python pubsub_replay.py pubsub.jsonl.gz.1 pubsub.jsonl.gz          (as fast as possible)
+# python pubsub_replay.py pubsub.jsonl.gz --pace --speed 10          (recorded pace, 10x faster)
+
+import argparse
+import collections
+import json
+import logging
+import time
+
+from TwitchChannelPointsMiner.classes.Chat import ChatPresence
+from TwitchChannelPointsMiner.classes.entities.Message import Message
+from TwitchChannelPointsMiner.classes.entities.Streamer import (
+    Streamer,
+    StreamerSettings,
+)
+from TwitchChannelPointsMiner.classes.Metrics import Metrics
+from TwitchChannelPointsMiner.classes.PubSubRecorder import PubSubRecorder
+from TwitchChannelPointsMiner.classes.Settings import Settings
+from TwitchChannelPointsMiner.classes.TwitchWebSocket import TwitchWebSocket
+from TwitchChannelPointsMiner.classes.WebSocketsPool import WebSocketsPool
+from TwitchChannelPointsMiner.logger import LoggerSettings
+
+
+class ReplayLogin(object):
+    username = "replay"
+
+    def get_auth_token(self):
+        return None
+
+    def get_user_id(self):
+        return None
+
+
+class ReplayTwitch(object):
+    # Stub of Twitch, every method is accepted and counted
+    def __init__(self):
+        self.twitch_login = ReplayLogin()
+        self.running = True
+        self.calls = collections.Counter()
+
+    def __getattr__(self, name):
+        def stub(*args, **kwargs):
+            self.calls[name] += 1
+
+        return stub
+
+
+def load_frames(paths):
+    frames = list(PubSubRecorder.read(paths))
+    # Create a streamer for each channel of the recording
+    channels = set()
+    for _, _, frame in frames:
+        try:
+            response = json.loads(frame)
+            if response["type"] == "MESSAGE":
+                channels.add(str(Message(response["data"]).channel_id))
+        except Exception:
+            pass
+    return frames, channels
+
+
+def create_streamer(channel_id):
+    settings = StreamerSettings(chat=ChatPresence.NEVER)
+    settings.default()
+    settings.bet.default()
+    streamer = Streamer(f"channel_{channel_id}", settings=settings)
+    streamer.channel_id = channel_id
+    streamer.is_online = True
+    streamer.channel_points = 10**9
+    return streamer
+
+
+def replay(frames, channels, pace=False, speed=1.0):
+    twitch = ReplayTwitch()
+    streamers = [create_streamer(channel_id) for channel_id in sorted(channels)]
+    pool = WebSocketsPool(twitch, streamers, {})
+    connections = {}
+
+    first_received_at = frames[0][0] if frames != [] else 0
+    start = time.perf_counter()
+    for received_at, index, frame in frames:
+        if pace is True:
+            delay = (received_at - first_received_at) / speed - (
+                time.perf_counter() - start
+            )
+            if delay > 0:
+                time.sleep(delay)
+        if index not in connections:
+            connections[index] = TwitchWebSocket(index, pool, None)
+        WebSocketsPool.on_message(connections[index], frame)
+    dispatched = time.perf_counter() - start
+
+    pool.fast_lane.join()
+    pool.workers.join()
+    elapsed = time.perf_counter() - start
+    pool.end()
+    return twitch, dispatched, elapsed
+
+
+def report(frames, channels, twitch, dispatched, elapsed):
+    print(f"Frames: {len(frames)}, channels: {len(channels)}")
+    print(
+        f"Dispatch: {round(dispatched, 3)}s ({round(len(frames) / max(dispatched, 1e-9))} frames/s), "
+        f"with the handlers: {round(elapsed, 3)}s ({round(len(frames) / max(elapsed, 1e-9))} frames/s)"
+    )
+    print("Handlers latency:")
+    for name, metric in Metrics.snapshot(prefix="pubsub.handler.").items():
+        if name.endswith(".seconds") and metric["count"] > 0:
+            print(
+                f"  {name[len('pubsub.handler.'):-len('.seconds')]}: count={metric['count']}, "
+                f"mean={round(metric['mean'] * 1000, 3)}ms, max={round(metric['max'] * 1000, 3)}ms"
+            )
+    print("Workers wait:")
+    for name, metric in Metrics.snapshot(prefix="pubsub.workers.").items():
+        if name.endswith(".seconds") and metric["count"] > 0:
+            print(
+                f"  {name}: count={metric['count']}, mean={round(metric['mean'] * 1000, 3)}ms, max={round(metric['max'] * 1000, 3)}ms"
+            )
+    print(f"Twitch calls: {dict(twitch.calls)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay recorded PubSub frames")
+    parser.add_argument("files", nargs="+", help="Recorded files, oldest first")
+    parser.add_argument(
+        "--pace", action="store_true", help="Keep the recorded pace between frames"
+    )
+    parser.add_argument(
+        "--speed", type=float, default=1.0, help="Speed multiplier for --pace"
+    )
+    parser.add_argument(
+        "--verbose", action="store_true", help="Show the logs of the handlers"
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO if args.verbose else logging.WARNING,
+        format="%(asctime)s - %(levelname)s - %(name)s - %(message)s",
+    )
+    Settings.logger = LoggerSettings()
+    Settings.enable_analytics = False
+    Settings.disable_ssl_cert_verification = False
+
+    frames, channels = load_frames(args.files)
+    twitch, dispatched, elapsed = replay(
+        frames, channels, pace=args.pace, speed=args.speed
+    )
+    report(frames, channels, twitch, dispatched, elapsed)
@@ -0,0 +1,403 @@
+#!/usr/bin/env python
+
+# Local stand-in of the Twitch PubSub server, for load and soak tests on a single box.
+# It speaks LISTEN/UNLISTEN/RESPONSE, PING/PONG, RECONNECT and sends generated MESSAGE frames
+# (points, predictions, viewcount and raids) on the topics listened by the clients.
+#
+# python pubsub_server.py --port 8080 --viewcount 50 --points 5 --predictions 0.2 --raids 0.05
+# TWITCH_PUBSUB_URL=ws://127.0.0.1:8080 python run.py
+#
+# --soak N runs also a WebSocketsPool in the same process, with N fake streamers and a stubbed Twitch.
+# python pubsub_server.py --soak 2000 --reconnect-every 60 --reconnect-ratio 1
+# --skew 5 runs the server clock 5 seconds ahead, check the clock.offset.seconds metric of the miner
+
+import argparse
+import asyncio
+import collections
+import json
+import logging
+import random
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+
+import websockets
+from websockets.exceptions import ConnectionClosed
+
+logger = logging.getLogger("pubsub_server")
+
+USER_TOPICS = ["community-points-user-v1", "predictions-user-v1"]
+# Seconds, server clock - local clock
+CLOCK_SKEW = 0
+
+
+def server_time():
+    return time.time() + CLOCK_SKEW
+
+
+def now_iso():
+    return (
+        datetime.fromtimestamp(server_time(), timezone.utc)
+        .isoformat()
+        .replace("+00:00", "Z")
+    )
+
+
+class Connection(object):
+    __slots__ = ["websocket", "topics"]
+
+    def __init__(self, websocket):
+        self.websocket = websocket
+        self.topics = set()
+
+
+class PubSubServer(object):
+    def __init__(
+        self,
+        max_topics=50,
+        rates=None,
+        reconnect_every=0,
+        reconnect_ratio=0.5,
+        reconnect_grace=30,
+    ):
+        self.max_topics = max_topics
+        # Frames per second for each generator, for the whole server
+        self.rates = rates or {}
+        self.reconnect_every = reconnect_every
+        self.reconnect_ratio = reconnect_ratio
+        self.reconnect_grace = reconnect_grace
+        self.connections = set()
+        self.stats = collections.Counter()
+
+    async def handle(self, websocket, path=None):
+        connection = Connection(websocket)
+        self.connections.add(connection)
+        self.stats["connections"] += 1
+        try:
+            async for raw in websocket:
+                await self.on_request(connection, json.loads(raw))
+        except ConnectionClosed:
+            pass
+        finally:
+            self.connections.discard(connection)
+
+    async def on_request(self, connection, request):
+        if request["type"] == "PING":
+            await self.send(connection, {"type": "PONG"})
+
+        elif request["type"] in ["LISTEN", "UNLISTEN"]:
+            topics = request.get("data", {}).get("topics", [])
+            error = ""
+            if request["type"] == "LISTEN":
+                if len(connection.topics | set(topics)) > self.max_topics:
+                    error = "ERR_BADMESSAGE"
+                elif request["data"].get("auth_token", None) is None and any(
+                    topic.split(".")[0] in USER_TOPICS for topic in topics
+                ):
+                    error = "ERR_BADAUTH"
+                else:
+                    connection.topics.update(topics)
+            else:
+                connection.topics.difference_update(topics)
+            self.stats[request["type"].lower()] += len(topics)
+            await self.send(
+                connection,
+                {"type": "RESPONSE", "nonce": request.get("nonce", ""), "error": error},
+            )
+
+    async def send(self, connection, frame):
+        try:
+            await connection.websocket.send(json.dumps(frame, separators=(",", ":")))
+            self.stats["frames"] += 1
+        except ConnectionClosed:
+            pass
+
+    async def publish(self, topic, message):
+        frame = {
+            "type": "MESSAGE",
+            "data": {"topic": topic, "message": json.dumps(message)},
+        }
+        # Like Twitch, every connection listening for the topic gets the message
+        for connection in list(self.connections):
+            if topic in connection.topics:
+                await self.send(connection, frame)
+                self.stats[f"messages.{topic.split('.')[0]}"] += 1
+
+    def random_topic(self, prefix):
+        topics = [
+            topic
+            for connection in self.connections
+            for topic in connection.topics
+            if topic.startswith(prefix + ".")
+        ]
+        return None if topics == [] else random.choice(topics)
+
+    # === MESSAGE generators === #
+    async def viewcount(self):
+        topic = self.random_topic("video-playback-by-id")
+        if topic is not None:
+            await self.publish(
+                topic,
+                {
+                    "type": "viewcount",
+                    "server_time": server_time(),
+                    "viewers": random.randint(1, 50000),
+                },
+            )
+
+    async def points(self):
+        topic = self.random_topic("community-points-user-v1")
+        channel = self.random_topic("video-playback-by-id")
+        if topic is None or channel is None:
+            return
+        user_id, channel_id = topic.split(".")[1], channel.split(".")[1]
+        total_points = random.choice([10, 12, 50, 250, 350])
+        await self.publish(
+            topic,
+            {
+                "type": "points-earned",
+                "data": {
+                    "timestamp": now_iso(),
+                    "channel_id": channel_id,
+                    "point_gain": {
+                        "user_id": user_id,
+                        "channel_id": channel_id,
+                        "total_points": total_points,
+                        "baseline_points": total_points,
+                        "reason_code": random.choice(["WATCH", "CLAIM", "WATCH_STREAK"]),
+                        "multipliers": [],
+                    },
+                    "balance": {
+                        "user_id": user_id,
+                        "channel_id": channel_id,
+                        "balance": random.randint(0, 10**6),
+                    },
+                },
+            },
+        )
+
+    async def raids(self):
+        topic = self.random_topic("raid")
+        if topic is not None:
+            await self.publish(
+                topic,
+                {
+                    "type": "raid_update_v2",
+                    "raid": {
+                        "id": str(uuid.uuid4()),
+                        "creator_id": topic.split(".")[1],
+                        "source_id": topic.split(".")[1],
+                        "target_id": str(random.randint(1, 10**8)),
+                        "target_login": f"raid_target_{random.randint(1, 1000)}",
+                        "target_display_name": "RaidTarget",
+                        "target_profile_image": "",
+                        "transition_jitter_seconds": 5,
+                        "force_raid_now_seconds": 90,
+                        "viewer_count": random.randint(1, 5000),
+                    },
+                },
+            )
+
+    async def predictions(self):
+        topic = self.random_topic("predictions-channel-v1")
+        if topic is not None:
+            # Runs in background: created, updated during the window, locked, resolved
+            asyncio.ensure_future(self.prediction_lifecycle(topic))
+
+    async def prediction_lifecycle(self, topic, window=60):
+        channel_id = topic.split(".")[1]
+        event = {
+            "id": str(uuid.uuid4()),
+            "channel_id": channel_id,
+            "created_at": now_iso(),
+            "created_by": {"type": "USER", "user_id": channel_id},
+            "ended_at": None,
+            "locked_at": None,
+            "outcomes": [
+                self.outcome("BLUE", "Yes"),
+                self.outcome("PINK", "No"),
+            ],
+            "prediction_window_seconds": window,
+            "status": "ACTIVE",
+            "title": f"Stand-in prediction {random.randint(1, 1000)}",
+            "winning_outcome_id": None,
+        }
+        await self.publish(
+            topic,
+            {"type": "event-created", "data": {"timestamp": now_iso(), "event": event}},
+        )
+        started = time.time()
+        while time.time() - started < window:
+            await asyncio.sleep(random.uniform(0.5, 3))
+            for outcome in event["outcomes"]:
+                users = random.randint(1, 20)
+                points = random.randint(10, 5000) * users
+                outcome["total_users"] += users
+                outcome["total_points"] += points
+                outcome["top_predictors"] = [
+                    {"points": max(points // users, 1), "user_id": "1"}
+                ]
+            await self.publish(
+                topic,
+                {"type": "event-updated", "data": {"timestamp": now_iso(), "event": event}},
+            )
+
+        event["status"] = "LOCKED"
+        event["locked_at"] = now_iso()
+        await self.publish(
+            topic,
+            {"type": "event-updated", "data": {"timestamp": now_iso(), "event": event}},
+        )
+        await asyncio.sleep(random.uniform(5, 30))
+        event["status"] = "RESOLVED"
+        event["ended_at"] = now_iso()
+        event["winning_outcome_id"] = random.choice(event["outcomes"])["id"]
+        await self.publish(
+            topic,
+            {"type": "event-updated", "data": {"timestamp": now_iso(), "event": event}},
+        )
+
+    @staticmethod
+    def outcome(color, title):
+        return {
+            "id": str(uuid.uuid4()),
+            "color": color,
+            "title": title,
+            "total_points": 0,
+            "total_users": 0,
+            "top_predictors": [],
+            "badge": {"version": color.lower(), "set_id": "predictions"},
+        }
+
+    async def generate(self, name, rate):
+        generator = getattr(self, name)
+        while True:
+            # Poisson arrivals
+            await asyncio.sleep(random.expovariate(rate))
+            await generator()
+
+    async def reconnect_storms(self):
+        while True:
+            await asyncio.sleep(self.reconnect_every)
+            victims = random.sample(
+                list(self.connections),
+                int(len(self.connections) * self.reconnect_ratio),
+            )
+            logger.info(f"RECONNECT sent to {len(victims)} connections")
+            for connection in victims:
+                await self.send(connection, {"type": "RECONNECT"})
+                self.stats["reconnect"] += 1
+            # Like Twitch, the connections are closed a bit later
+            await asyncio.sleep(self.reconnect_grace)
+            for connection in victims:
+                await connection.websocket.close()
+
+    async def print_stats(self, interval=10):
+        while True:
+            await asyncio.sleep(interval)
+            topics = sum(len(connection.topics) for connection in self.connections)
+            logger.info(
+                f"Connections: {len(self.connections)}, topics: {topics}, {dict(self.stats)}"
+            )
+
+    async def serve(self, host, port):
+        async with websockets.serve(self.handle, host, port, max_size=None):
+            logger.info(f"PubSub stand-in listening on ws://{host}:{port}")
+            tasks = [
+                asyncio.ensure_future(self.generate(name, rate))
+                for name, rate in self.rates.items()
+                if rate > 0
+            ]
+            if self.reconnect_every > 0:
+                tasks.append(asyncio.ensure_future(self.reconnect_storms()))
+            tasks.append(asyncio.ensure_future(self.print_stats()))
+            await asyncio.gather(*tasks)
+
+
+def soak(url, streamers_count):
+    # Import here: the server alone doesn't need the miner
+    import TwitchChannelPointsMiner.classes.WebSocketsPool as pool_module
+    from pubsub_replay import ReplayTwitch, create_streamer
+    from TwitchChannelPointsMiner.classes.entities.PubsubTopic import PubsubTopic
+    from TwitchChannelPointsMiner.classes.Metrics import Metrics
+    from TwitchChannelPointsMiner.classes.Settings import Settings
+    from TwitchChannelPointsMiner.classes.SubscriptionBudget import SubscriptionBudget
+    from TwitchChannelPointsMiner.logger import LoggerSettings
+
+    Settings.logger = LoggerSettings()
+    Settings.enable_analytics = False
+    Settings.disable_ssl_cert_verification = False
+
+    pool_module.WEBSOCKET = url
+    streamers = [create_streamer(str(index)) for index in range(1, streamers_count + 1)]
+    twitch = ReplayTwitch()
+    twitch.twitch_login.get_auth_token = lambda: "soak"
+    # The stand-in has no per-IP limit
+    WebSocketsPool = pool_module.WebSocketsPool
+    topics = 2 + sum(len(SubscriptionBudget.topics_for(s)) for s in streamers)
+    WebSocketsPool.MAX_CONNECTIONS = max(
+        WebSocketsPool.MAX_CONNECTIONS, topics // WebSocketsPool.MAX_TOPICS + 2
+    )
+    pool = WebSocketsPool(twitch, streamers, {})
+    pool.submit(
+        [
+            PubsubTopic("community-points-user-v1", user_id="1"),
+            PubsubTopic("predictions-user-v1", user_id="1"),
+        ]
+    )
+    for streamer in streamers:
+        pool.submit(SubscriptionBudget.topics_for(streamer))
+
+    while True:
+        time.sleep(30)
+        Metrics.report(prefix="pubsub.")
+        Metrics.report(prefix="clock.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local Twitch PubSub stand-in")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--max-topics", type=int, default=50, help="Per connection")
+    parser.add_argument("--viewcount", type=float, default=20, help="Frames/s")
+    parser.add_argument("--points", type=float, default=2, help="Frames/s")
+    parser.add_argument("--predictions", type=float, default=0.05, help="New events/s")
+    parser.add_argument("--raids", type=float, default=0.01, help="Frames/s")
+    parser.add_argument(
+        "--reconnect-every", type=float, default=0, help="Seconds between RECONNECT storms, 0 disabled"
+    )
+    parser.add_argument(
+        "--reconnect-ratio", type=float, default=0.5, help="Share of connections hit by a storm"
+    )
+    parser.add_argument(
+        "--soak", type=int, default=0, help="Run also a WebSocketsPool with N fake streamers"
+    )
+    parser.add_argument(
+        "--skew", type=float, default=0, help="Seconds, the server clock is ahead of the local one"
+    )
+    args = parser.parse_args()
+    CLOCK_SKEW = args.skew
+
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s - %(name)s - %(message)s"
+    )
+    server = PubSubServer(
+        max_topics=args.max_topics,
+        rates={
+            "viewcount": args.viewcount,
+            "points": args.points,
+            "predictions": args.predictions,
+            "raids": args.raids,
+        },
+        reconnect_every=args.reconnect_every,
+        reconnect_ratio=args.reconnect_ratio,
+    )
+    if args.soak > 0:
+        thread = threading.Thread(
+            target=soak, args=(f"ws://{args.host}:{args.port}", args.soak)
+        )
+        thread.daemon = True
+        thread.name = "Soak"
+        thread.start()
+    asyncio.run(server.serve(args.host, args.port))
@@ -27,7 +27,7 @@ setuptools.setup(
     include_package_data=True,
     install_requires=[
         "requests",
-        "websocket-client",
+        "websockets",
         "pillow",
         "python-dateutil",
         "emoji",
@@ -37,6 +37,7 @@ setuptools.setup(
         "flask",
         "irc",
         "pandas",
+        "numpy",
         "pytz"
     ],
     long_description=read("README.md"),